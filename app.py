@@ -1,72 +1,426 @@
-from flask import Flask
+from flask import Flask, Blueprint, current_app, copy_current_request_context, stream_with_context
 from flask import render_template
 from flask import request, redirect, url_for
-from flask import abort
+from flask import abort, send_from_directory
 from flask import flash
 import sqlite3
 import os
+import random
+import time
+import uuid
 from flask import g 
 from flask import jsonify
 import json
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from email_validator import validate_email, EmailNotValidError
+try:
+    import orjson
+except ImportError:  # Optional faster encoder for the JSON catalog API
+    orjson = None
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from werkzeug.local import LocalProxy
+import metrics
+from cache import (TTLCache, SQLiteCache, TieredCache, SingleFlight, catalog_version, bump_catalog_version,
+                   stock_version, bump_stock_version, configure_catalog_version, CATALOG_VERSION_FILENAME)
+from password_hashing import PasswordHasher, HasherBusyError
+from login_throttle import LoginThrottle
+from suggest import PrefixIndex
+import guest_cart
+from db_backup import BackupJob, list_snapshots
+import orders
+import thumbnails
+import events
+from profiler import SamplingProfiler
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-app = Flask(__name__, instance_relative_config=True)
-app.secret_key = 'your-secret-key-change-in-production'
+bp = Blueprint('store', __name__)
+
+def config_from_env(instance_path):
+    """Read the app settings from the environment"""
+    return {
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production'),
+        # Database will be stored in instance/cart.db
+        'DATABASE': os.environ.get('DATABASE', os.path.join(instance_path, 'cart.db')),
+
+        # Password hashing parameters; use the full method string (e.g. 'scrypt:32768:8:1')
+        # so stored hashes made with other parameters are detected and upgraded on login
+        'PASSWORD_HASH_METHOD': os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000'),
+        'PASSWORD_HASH_WORKERS': int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+        'PASSWORD_HASH_MAX_PENDING': int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64)),
+
+        # Logged-in users are cached briefly so most requests skip the users table
+        'USER_CACHE_SIZE': int(os.environ.get('USER_CACHE_SIZE', 1024)),
+        'USER_CACHE_TTL': float(os.environ.get('USER_CACHE_TTL', 60)),
+
+        # Login attempts allowed per client IP and per account (burst size and refill per minute);
+        # set LOGIN_THROTTLE_DB to a SQLite path to keep the limits across restarts
+        'LOGIN_IP_BURST': float(os.environ.get('LOGIN_IP_BURST', 20)),
+        'LOGIN_IP_PER_MINUTE': float(os.environ.get('LOGIN_IP_PER_MINUTE', 10)),
+        'LOGIN_ACCOUNT_BURST': float(os.environ.get('LOGIN_ACCOUNT_BURST', 5)),
+        'LOGIN_ACCOUNT_PER_MINUTE': float(os.environ.get('LOGIN_ACCOUNT_PER_MINUTE', 1)),
+        'LOGIN_THROTTLE_DB': os.environ.get('LOGIN_THROTTLE_DB'),
+
+        # Online database snapshots taken from the admin endpoint
+        'BACKUP_DIR': os.environ.get('BACKUP_DIR', os.path.join(instance_path, 'backups')),
+
+        # Compiled templates are cached here so restarted workers skip parsing them
+        'JINJA_CACHE_DIR': os.environ.get('JINJA_CACHE_DIR', os.path.join(instance_path, 'jinja_cache')),
+
+        # Catalog data cached in each worker is backed by a SQLite file shared by all workers
+        # on the host (empty to keep it per worker); the catalog version counter lives in a
+        # memory-mapped file, next to the database by default, so writes invalidate every worker
+        'SHARED_CACHE_DB': os.environ.get('SHARED_CACHE_DB', os.path.join(instance_path, 'cache.db')),
+        'CATALOG_VERSION_FILE': os.environ.get('CATALOG_VERSION_FILE'),
+
+        # Rendered product pages are fresh for PRODUCT_PAGE_FRESH seconds, then served while
+        # being refreshed in the background until PRODUCT_PAGE_STALE seconds old
+        'PRODUCT_PAGE_FRESH': float(os.environ.get('PRODUCT_PAGE_FRESH', 30)),
+        'PRODUCT_PAGE_STALE': float(os.environ.get('PRODUCT_PAGE_STALE', 300)),
+
+        # Search result pages (product id lists) kept per worker
+        'SEARCH_CACHE_SIZE': int(os.environ.get('SEARCH_CACHE_SIZE', 4096)),
+
+        # Video thumbnails fetched by thumbnails.py, served from here with immutable caching
+        'THUMBNAIL_DIR': os.environ.get('THUMBNAIL_DIR', os.path.join(instance_path, 'thumbnails')),
+
+        # Live stock/cart event streams. Each open stream holds a server thread under WSGI, so
+        # they're off unless enabled (asgi.py enables them); then the open streams allowed
+        # per worker and seconds between heartbeats, when streams re-read their state
+        'LIVE_UPDATES': os.environ.get('LIVE_UPDATES', '0') != '0',
+        'EVENTS_MAX_SUBSCRIBERS': int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', events.MAX_SUBSCRIBERS)),
+        'EVENTS_HEARTBEAT': float(os.environ.get('EVENTS_HEARTBEAT', events.HEARTBEAT)),
+
+        # Seconds a checkout waits for the order writer before answering 202 with a status URL
+        'CHECKOUT_WAIT': float(os.environ.get('CHECKOUT_WAIT', 2)),
+
+        # Sampling profiler: endpoints always profiled (e.g. 'store.product_detail,store.search'),
+        # the fraction of other requests profiled at random, and milliseconds between samples
+        'PROFILE_ENDPOINTS': frozenset(filter(None, os.environ.get('PROFILE_ENDPOINTS', '').split(','))),
+        'PROFILE_SAMPLE_RATE': float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+        'PROFILE_INTERVAL_MS': float(os.environ.get('PROFILE_INTERVAL_MS', 5)),
+
+        # Create/seed the database and prime catalog caches and templates in create_app()
+        'INIT_DB': os.environ.get('INIT_DB', '1') != '0',
+        'WARM_UP': os.environ.get('WARM_UP', '1') != '0',
+    }
+
+def create_app(config=None):
+    """Build the application; config overrides settings read from the environment"""
+    app = Flask(__name__, instance_relative_config=True)
+    app.config.from_mapping(config_from_env(app.instance_path))
+    if config:
+        app.config.from_mapping(config)
+
+    # Ensure instance directory exists
+    os.makedirs(app.instance_path, exist_ok=True)
+    if app.config['JINJA_CACHE_DIR']:
+        os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])
+
+    if app.config['CATALOG_VERSION_FILE'] is None:
+        app.config['CATALOG_VERSION_FILE'] = os.path.join(
+            os.path.dirname(os.path.abspath(app.config['DATABASE'])), CATALOG_VERSION_FILENAME)
+    configure_catalog_version(app.config['CATALOG_VERSION_FILE'])
+    shared_cache = SQLiteCache(app.config['SHARED_CACHE_DB']) if app.config['SHARED_CACHE_DB'] else None
+    app.extensions['catalog_cache'] = TieredCache(TTLCache(maxsize=1024, ttl=300), shared_cache)
+    app.extensions['product_page_cache'] = TTLCache(maxsize=256, ttl=app.config['PRODUCT_PAGE_STALE'])
+    app.extensions['product_page_loads'] = SingleFlight()
+    app.extensions['search_cache'] = TieredCache(TTLCache(maxsize=app.config['SEARCH_CACHE_SIZE'], ttl=300),
+                                                 shared_cache)
+    app.extensions['suggest_index'] = PrefixIndex()
+
+    app.extensions['login_throttle'] = LoginThrottle(
+        ip_burst=app.config['LOGIN_IP_BURST'],
+        ip_per_minute=app.config['LOGIN_IP_PER_MINUTE'],
+        account_burst=app.config['LOGIN_ACCOUNT_BURST'],
+        account_per_minute=app.config['LOGIN_ACCOUNT_PER_MINUTE'],
+        persist_path=app.config['LOGIN_THROTTLE_DB'],
+    )
+    # The hash process pool itself is started on first use
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+    )
+    app.extensions['user_cache'] = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    app.extensions['backup_job'] = BackupJob(app.config['BACKUP_DIR'])
+    # Stock and cart changes published to /api/events streams in this worker
+    app.extensions['event_broker'] = events.EventBroker(max_subscribers=app.config['EVENTS_MAX_SUBSCRIBERS'])
+    # Checkouts are placed by one writer thread per worker, started on first use
+    app.extensions['order_writer'] = orders.OrderWriter(app.config['DATABASE'],
+                                                        event_broker=app.extensions['event_broker'])
+    app.extensions['profiler'] = SamplingProfiler(interval=app.config['PROFILE_INTERVAL_MS'] / 1000)
+    # Anonymous visitors keep their cart in a signed cookie until they log in
+    app.extensions['guest_cart_codec'] = guest_cart.GuestCartCodec(app.config['SECRET_KEY'])
+
+    login_manager.init_app(app)
+    app.teardown_appcontext(close_db)
+    app.register_blueprint(bp)
+
+    with app.app_context():
+        if app.config['INIT_DB']:
+            setup()
+        if app.config['WARM_UP']:
+            warm_up(app)
+    return app
+
+# Per-app services created by create_app(), looked up through the current app
+login_throttle = LocalProxy(lambda: current_app.extensions['login_throttle'])
+password_hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
+user_cache = LocalProxy(lambda: current_app.extensions['user_cache'])
+backup_job = LocalProxy(lambda: current_app.extensions['backup_job'])
+order_writer = LocalProxy(lambda: current_app.extensions['order_writer'])
+event_broker = LocalProxy(lambda: current_app.extensions['event_broker'])
+profiler = LocalProxy(lambda: current_app.extensions['profiler'])
+guest_cart_codec = LocalProxy(lambda: current_app.extensions['guest_cart_codec'])
+# Catalog-derived data, keyed by catalog version so product writes invalidate it
+catalog_cache = LocalProxy(lambda: current_app.extensions['catalog_cache'])
+product_page_cache = LocalProxy(lambda: current_app.extensions['product_page_cache'])
+product_page_loads = LocalProxy(lambda: current_app.extensions['product_page_loads'])
+search_cache = LocalProxy(lambda: current_app.extensions['search_cache'])
+suggest_index = LocalProxy(lambda: current_app.extensions['suggest_index'])
 
 # Initialize Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'store.login'
 login_manager.login_message = 'Please log in to access this page.'
 
 # --- Database helpers ---
-# Use instance folder for database (works regardless of parent folder name)
-import os
-
-# Ensure instance directory exists
-os.makedirs(app.instance_path, exist_ok=True)
-
-# Database will be stored in instance/cart.db
-DB_PATH = os.path.join(app.instance_path, 'cart.db')
-print(f"Using database at: {DB_PATH}")  # Helpful for debugging
-
 def get_db():
     db = getattr(g, '_db', None)
     if db is None:
-        db = g._db = sqlite3.connect(DB_PATH, check_same_thread=False)
-        db.row_factory = sqlite3.Row
+        pool = current_app.extensions.get('db_pool')
+        if pool is not None and pool.on_pool_thread():
+            # Served by asgi.py, whose worker threads each keep one connection open
+            db = g._db = pool.connection()
+            g._db_pooled = True
+        else:
+            db = g._db = sqlite3.connect(current_app.config['DATABASE'], check_same_thread=False)
+            db.row_factory = sqlite3.Row
     return db
 
+CART_ITEMS_SQL = '''
+    SELECT ci.id, ci.product_id, ci.quantity, ci.price_snapshot,
+           p.name, p.price, p.image_url, p.stock
+    FROM cart_items ci
+    JOIN products p ON p.id = ci.product_id
+    WHERE ci.user_id = ?
+    ORDER BY ci.id DESC
+'''
+
 def get_cart_items():
-    """Helper function to get cart items for the current user"""
+    """Helper function to get cart items for the current user.
+
+    Names and prices are joined from products, so price is always the
+    current price and price_snapshot is what it cost when added. Guest
+    carts are read from their cookie, with item ids equal to product ids.
+    """
     if not current_user.is_authenticated:
-        return []
+        lines = get_guest_cart()
+        products = get_product_summaries(lines)
+        return [
+            dict(products[product_id], product_id=product_id, quantity=quantity,
+                 price_snapshot=products[product_id]['price'])
+            for product_id, quantity in lines.items() if product_id in products
+        ]
     db = get_db()
-    return db.execute('SELECT id, name, price FROM cart_items WHERE user_id = ? ORDER BY id DESC', (current_user.id,)).fetchall()
+    return db.execute(CART_ITEMS_SQL, (current_user.id,)).fetchall()
+
+def get_guest_cart():
+    """Return the anonymous visitor's cart lines, parsed from the cookie once per request."""
+    if 'guest_cart' not in g:
+        g.guest_cart = guest_cart_codec.loads(request.cookies.get(guest_cart.COOKIE_NAME))
+    return g.guest_cart
+
+def save_guest_cart():
+    """Mark the guest cart as changed so the response rewrites its cookie."""
+    g.guest_cart_changed = True
+
+@bp.before_app_request
+def start_profiling():
+    """Sample this request's stacks if its endpoint is profiled, or at random at PROFILE_SAMPLE_RATE"""
+    config = current_app.config
+    if request.endpoint in config['PROFILE_ENDPOINTS'] or (
+            config['PROFILE_SAMPLE_RATE'] and random.random() < config['PROFILE_SAMPLE_RATE']):
+        profiler.start(request.endpoint or 'unmatched')
+        g.profiling = True
+
+@bp.teardown_app_request
+def stop_profiling(exc):
+    if g.get('profiling'):
+        profiler.stop()
+
+@bp.after_app_request
+def write_guest_cart(response):
+    if g.get('guest_cart_changed'):
+        if g.guest_cart:
+            response.set_cookie(guest_cart.COOKIE_NAME, guest_cart_codec.dumps(g.guest_cart),
+                                max_age=guest_cart.MAX_AGE, httponly=True, samesite='Lax')
+        else:
+            response.delete_cookie(guest_cart.COOKIE_NAME)
+    return response
+
+def merge_guest_cart(user_id):
+    """Fold the guest cart into the user's cart_items with one batched upsert.
+
+    The caller commits; quantities add to lines the user already has.
+    """
+    lines = get_guest_cart()
+    if not lines:
+        return
+    get_db().executemany('''
+        INSERT INTO cart_items (user_id, product_id, quantity, price_snapshot)
+        SELECT ?, id, ?, price FROM products WHERE id = ?
+        ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+    ''', [(user_id, quantity, product_id) for product_id, quantity in lines.items()])
+    metrics.incr('guest_cart.merged')
+    lines.clear()
+    save_guest_cart()
+
+def get_product_summaries(product_ids):
+    """Return {id: {id, name, category, price, image_url, stock}} for the given products.
+
+    Served from catalog_cache; misses are loaded with a single query. Entries
+    aren't invalidated by stock changes, so stock may lag by the cache TTL;
+    orders check stock when they are placed.
+    """
+    version = catalog_version()
+    found, missing = {}, []
+    for product_id in product_ids:
+        summary = catalog_cache.get(('product_summary', version, product_id))
+        if summary is None:
+            missing.append(product_id)
+        else:
+            found[product_id] = summary
+    if missing:
+        placeholders = ','.join('?' * len(missing))
+        rows = get_db().execute(
+            f'SELECT id, name, category, price, image_url, stock FROM products WHERE id IN ({placeholders})', missing
+        ).fetchall()
+        for row in rows:
+            summary = dict(row)
+            catalog_cache.set(('product_summary', version, row['id']), summary)
+            found[row['id']] = summary
+    return found
 
 def get_categories():
     """Helper function to get all product categories"""
+    key = ('categories', catalog_version())
+    categories = catalog_cache.get(key)
+    if categories is None:
+        db = get_db()
+        categories = [dict(row) for row in db.execute(
+            'SELECT DISTINCT category FROM products ORDER BY category'
+        ).fetchall()]
+        catalog_cache.set(key, categories)
+    return categories
+
+def load_suggest_data():
+    """Product names and categories for the type-ahead index"""
     db = get_db()
-    return db.execute('SELECT DISTINCT category FROM products ORDER BY category').fetchall()
+    products = db.execute('SELECT id, name FROM products').fetchall()
+    return [(row['id'], row['name']) for row in products], [row['category'] for row in get_categories()]
+
+# Price ranges offered as search facets: (key, label, min inclusive, max exclusive)
+PRICE_BUCKETS = [
+    ('0-100', 'Under $100', 0, 100),
+    ('100-500', '$100 - $500', 100, 500),
+    ('500-1000', '$500 - $1,000', 500, 1000),
+    ('1000-2500', '$1,000 - $2,500', 1000, 2500),
+    ('2500-', '$2,500 & up', 2500, None),
+]
+PRICE_BUCKET_SQL = 'CASE ' + ' '.join(
+    f'WHEN price < {high} THEN {index}' for index, (_, _, _, high) in enumerate(PRICE_BUCKETS) if high is not None
+) + f' ELSE {len(PRICE_BUCKETS) - 1} END'
 
-@app.context_processor
+def normalize_query(query):
+    """Lowercase and collapse whitespace so equivalent searches share cache entries"""
+    return ' '.join(query.lower().split())
+
+def text_filter(query):
+    """SQL condition and parameters matching a search term against name and description"""
+    if not query:
+        return '1=1', []
+    term = f"%{query}%"
+    return '(LOWER(name) LIKE ? OR LOWER(description) LIKE ?)', [term, term]
+
+def get_facet_counts(query):
+    """Product counts per (category, price bucket, in stock) for a search term.
+
+    One aggregate pass over the matching products; the handful of resulting
+    rows are cached per normalized query and catalog and stock version, and
+    every facet count on the page is derived from them.
+    """
+    key = ('facets', catalog_version(), stock_version(), query)
+    rows = catalog_cache.get(key)
+    if rows is None:
+        condition, params = text_filter(query)
+        db = get_db()
+        rows = [tuple(row) for row in db.execute(f'''
+            SELECT category, {PRICE_BUCKET_SQL} AS bucket, stock > 0 AS in_stock, COUNT(*) AS count
+            FROM products
+            WHERE {condition}
+            GROUP BY category, bucket, in_stock
+        ''', params).fetchall()]
+        catalog_cache.set(key, rows)
+    return rows
+
+def build_facets(rows, category, bucket_index, in_stock_only):
+    """Derive facet counts, each facet filtered by the other selections but not its own"""
+    def matches(row, skip):
+        row_category, row_bucket, row_in_stock, _ = row
+        return ((skip == 'category' or not category or row_category == category) and
+                (skip == 'price' or bucket_index is None or row_bucket == bucket_index) and
+                (skip == 'stock' or not in_stock_only or row_in_stock))
+
+    category_counts = {}
+    bucket_counts = [0] * len(PRICE_BUCKETS)
+    in_stock_count = 0
+    for row in rows:
+        if matches(row, 'category'):
+            category_counts[row[0]] = category_counts.get(row[0], 0) + row[3]
+        if matches(row, 'price'):
+            bucket_counts[row[1]] += row[3]
+        if matches(row, 'stock') and row[2]:
+            in_stock_count += row[3]
+
+    return {
+        'categories': sorted(category_counts.items()),
+        'prices': [
+            {'key': key, 'label': label, 'count': count}
+            for (key, label, _, _), count in zip(PRICE_BUCKETS, bucket_counts)
+        ],
+        'in_stock': in_stock_count,
+    }
+
+@bp.app_context_processor
 def inject_globals():
     """Make global variables available to all templates"""
     return {
         'categories': get_categories()
     }
 
-@app.teardown_appcontext
+@bp.app_template_filter('duration')
+def format_duration(seconds):
+    """Format a video length in seconds as M:SS (or H:MM:SS)"""
+    minutes, seconds = divmod(int(seconds or 0), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
 def close_db(exception):
     db = getattr(g, '_db', None)
     if db is not None:
-        db.close()
+        if g.get('_db_pooled'):
+            # Stays open for the thread's next request; never hand it over mid-transaction
+            db.rollback()
+        else:
+            db.close()
 
 def init_db():
     try:
-        print(f"Initializing database at: {DB_PATH}")
+        print(f"Initializing database at: {current_app.config['DATABASE']}")
         db = get_db()
         
         # Enable foreign key support
@@ -81,36 +435,39 @@ def init_db():
                 email TEXT NOT NULL UNIQUE,
                 password_hash TEXT NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
+                last_login TIMESTAMP,
+                session_version INTEGER NOT NULL DEFAULT 0
             )
             """
         )
 
+        # Add session_version column if it doesn't exist (for existing databases)
+        user_columns = [col[1] for col in db.execute("PRAGMA table_info(users)").fetchall()]
+        if 'session_version' not in user_columns:
+            db.execute('ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0')
+
+        # One line per user and product; names and current prices come from products
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS cart_items (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                name TEXT NOT NULL,
-                price REAL NOT NULL DEFAULT 0,
-                product_id INTEGER,
+                user_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL DEFAULT 1,
+                price_snapshot REAL NOT NULL DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (product_id) REFERENCES products(id),
+                UNIQUE (user_id, product_id)
             )
             """
         )
 
-        # Add user_id column if it doesn't exist (for existing databases)
-        cursor = db.cursor()
-        cursor.execute("PRAGMA table_info(cart_items)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'user_id' not in columns:
-            cursor.execute('ALTER TABLE cart_items ADD COLUMN user_id INTEGER')
-        if 'product_id' not in columns:
-            cursor.execute('ALTER TABLE cart_items ADD COLUMN product_id INTEGER')
-        if 'quantity' not in columns:
-            cursor.execute('ALTER TABLE cart_items ADD COLUMN quantity INTEGER DEFAULT 1')
-        
+        cart_columns = [col[1] for col in db.execute("PRAGMA table_info(cart_items)").fetchall()]
+        if 'price_snapshot' not in cart_columns:
+            print("Warning: cart_items still uses the name-based schema; "
+                  "run migrations/004_cart_items_product_id.py")
+
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS products (
@@ -121,10 +478,18 @@ def init_db():
                 description TEXT,
                 image_url TEXT,
                 stock INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sku TEXT
             )
             """
         )
+
+        # Add sku column if it doesn't exist (for existing databases)
+        product_columns = [col[1] for col in db.execute("PRAGMA table_info(products)").fetchall()]
+        if 'sku' not in product_columns:
+            db.execute('ALTER TABLE products ADD COLUMN sku TEXT')
+        # Bulk imports upsert by SKU; NULLs don't conflict, so seeded products need none
+        db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products (sku)')
         
         db.execute(
             """
@@ -138,6 +503,50 @@ def init_db():
             )
             """
         )
+        # The home page lists a user's latest views; product pages look up one user's rows
+        db.execute('CREATE INDEX IF NOT EXISTS idx_recently_viewed_user ON recently_viewed (user_id, viewed_at)')
+
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS product_videos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL,
+                video_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                channel TEXT,
+                duration_seconds INTEGER DEFAULT 0,
+                views INTEGER DEFAULT 0,
+                published TEXT,
+                rank INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (product_id) REFERENCES products(id)
+            )
+            """
+        )
+        # Category filters with price ranges are index seeks
+        db.execute('CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category, price)')
+
+        # Product pages fetch videos by product in rank order
+        db.execute(
+            'CREATE INDEX IF NOT EXISTS idx_product_videos_product_id ON product_videos (product_id, rank)'
+        )
+
+        # Filled by recommendations.py; product pages read one product's rows by primary key
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS product_recommendations (
+                product_id INTEGER NOT NULL,
+                rank INTEGER NOT NULL,
+                recommended_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (product_id, rank)
+            )
+            """
+        )
+
+        # orders and order_lines, written by the checkout writer
+        orders.ensure_schema(db)
+        # Local copies of video thumbnails, filled by thumbnails.py
+        thumbnails.ensure_schema(db)
         db.commit()
         print("Database initialized successfully")
     except sqlite3.Error as e:
@@ -145,20 +554,51 @@ def init_db():
         raise
 
 # User class for Flask-Login
-class User(UserMixin):
-    def __init__(self, id, username, email, password_hash):
+class User:
+    """The logged-in user; deliberately does not carry the password hash"""
+    __slots__ = ('id', 'username', 'email', 'session_version')
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email, session_version=0):
         self.id = id
         self.username = username
         self.email = email
-        self.password_hash = password_hash
+        self.session_version = session_version
+
+    def get_id(self):
+        # Stored in the session; bumping users.session_version invalidates it
+        return f"{self.id}:{self.session_version}"
+
+def invalidate_user(user_id, end_sessions=False):
+    """Drop a cached user after an account change, optionally logging out all their sessions"""
+    if end_sessions:
+        db = get_db()
+        db.execute('UPDATE users SET session_version = session_version + 1 WHERE id = ?', (user_id,))
+        db.commit()
+    user_cache.pop(int(user_id))
 
 @login_manager.user_loader
 def load_user(user_id):
-    db = get_db()
-    user = db.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    if user:
-        return User(user['id'], user['username'], user['email'], user['password_hash'])
-    return None
+    user_id, _, session_version = user_id.partition(':')
+    try:
+        user_id, session_version = int(user_id), int(session_version or 0)
+    except ValueError:
+        return None
+
+    user = user_cache.get(user_id)
+    if user is None:
+        db = get_db()
+        row = db.execute('SELECT id, username, email, session_version FROM users WHERE id = ?', (user_id,)).fetchone()
+        if not row:
+            return None
+        user = User(row['id'], row['username'], row['email'], row['session_version'])
+        user_cache.set(user_id, user)
+    if user.session_version != session_version:
+        return None
+    return user
 
 def seed_products():
     """Seed sample products if products table is empty."""
@@ -307,6 +747,7 @@ def seed_products():
             ],
         )
         db.commit()
+        bump_catalog_version()
 
 def update_product_images():
     """Update existing products with appropriate images."""
@@ -352,18 +793,25 @@ def update_product_images():
     
     db.commit()
 
-@app.before_request
 def setup():
     init_db()
     seed_products()
     update_product_images()
 
+def warm_up(app):
+    """Prime this process's catalog caches and compile every template"""
+    get_categories()
+    get_facet_counts('')
+    suggest_index.ensure_current(catalog_version(), load_suggest_data)
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
 # --- Routes ---
-@app.route('/')
+@bp.route('/')
 def home():
     db = get_db()
+    items = get_cart_items()
     if current_user.is_authenticated:
-        items = db.execute('SELECT id, name, price FROM cart_items WHERE user_id = ? ORDER BY id DESC', (current_user.id,)).fetchall()
         # Get recently viewed products for this user
         recently_viewed = db.execute('''
             SELECT p.id, p.name, p.price 
@@ -374,60 +822,65 @@ def home():
             LIMIT 5
         ''', (current_user.id,)).fetchall()
     else:
-        items = []  # No cart items for non-authenticated users
         recently_viewed = []  # No recently viewed for non-authenticated users
-    total = sum((row['price'] or 0) for row in items)
+    total = sum((row['price'] or 0) * (row['quantity'] or 1) for row in items)
     return render_template('index.html', cart_items=items, cart_total=total, recently_viewed=recently_viewed)
 
-@app.route('/page-2.html')
+@bp.route('/page-2.html')
 def page2():
     return render_template('page-2.html')
 
-@app.route('/index.html')
+@bp.route('/index.html')
 def index():
     return home()
 
-@app.route('/add-item', methods=['POST'])
+@bp.route('/add-item', methods=['POST'])
 @login_required
 def add_item():
+    # Cart lines must reference a catalog product; the free-text form adds it by name
     name = request.form.get('name', '').strip()
-    price_raw = request.form.get('price', '0').strip()
-    try:
-        price = float(price_raw)
-    except ValueError:
-        price = 0.0
     if name:
         db = get_db()
-        db.execute('INSERT INTO cart_items (name, price, user_id) VALUES (?, ?, ?)', (name, price, current_user.id))
-        db.commit()
-    return redirect(url_for('home'))
+        product = db.execute('SELECT id, price FROM products WHERE name = ? COLLATE NOCASE ORDER BY id LIMIT 1',
+                             (name,)).fetchone()
+        if product is None:
+            flash(f'No product named "{name}" was found.', 'error')
+        else:
+            db.execute('''
+                INSERT INTO cart_items (user_id, product_id, quantity, price_snapshot) VALUES (?, ?, 1, ?)
+                ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + 1
+            ''', (current_user.id, product['id'], product['price']))
+            db.commit()
+            events.publish_cart(event_broker, db, current_user.id)
+    return redirect(url_for('.home'))
 
-@app.route('/remove-item/<int:item_id>', methods=['POST'])
-@login_required
+@bp.route('/remove-item/<int:item_id>', methods=['POST'])
 def remove_item(item_id: int):
+    if not current_user.is_authenticated:
+        if get_guest_cart().pop(item_id, None) is not None:
+            save_guest_cart()
+        return redirect(url_for('.home'))
     db = get_db()
     db.execute('DELETE FROM cart_items WHERE id = ? AND user_id = ?', (item_id, current_user.id))
     db.commit()
-    return redirect(url_for('home'))
+    events.publish_cart(event_broker, db, current_user.id)
+    return redirect(url_for('.home'))
 
-@app.route('/search')
+@bp.route('/search')
 @login_required
 def search():
     query = (request.args.get('q') or '').strip()
     category = (request.args.get('category') or '').strip().lower()
+    price = (request.args.get('price') or '').strip()
+    in_stock_only = request.args.get('in_stock') == '1'
 
-    db = get_db()
-    sql = 'SELECT * FROM products WHERE 1=1'
-    params = []
-
-    if query:
-        sql += ' AND (LOWER(name) LIKE ? OR LOWER(description) LIKE ?)'
-        term = f"%{query.lower()}%"
-        params.extend([term, term])
-
-    if category:
-        sql += ' AND LOWER(category) = ?'
-        params.append(category)
+    # Resolve the category to its stored spelling so the (category, price) index applies
+    category_name = next((row['category'] for row in get_categories() if row['category'].lower() == category), None)
+    if category and category_name is None:
+        category_name = category
+    bucket_index = next((index for index, bucket in enumerate(PRICE_BUCKETS) if bucket[0] == price), None)
+    if bucket_index is None:
+        price = ''
 
     sort_by = request.args.get('sort', 'name')
     sort_order = request.args.get('order', 'asc')
@@ -436,40 +889,217 @@ def search():
         sort_by = 'name'
     if sort_order.lower() not in ['asc', 'desc']:
         sort_order = 'asc'
-    sql += f' ORDER BY {sort_by} {sort_order.upper()}'
+    sort_order = sort_order.lower()
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
 
-    products = db.execute(sql, params).fetchall()
-    categories = db.execute('SELECT DISTINCT category FROM products').fetchall()
+    normalized_query = normalize_query(query)
+    product_ids, total = search_product_ids(normalized_query, category_name, bucket_index, in_stock_only,
+                                            sort_by, sort_order, page)
+    page_count = max((total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE, 1)
+    if page > page_count:
+        return redirect(url_for('.search', **dict(request.args.to_dict(), page=page_count)))
+    summaries = get_product_summaries(product_ids)
+    facets = build_facets(get_facet_counts(normalized_query), category_name, bucket_index, in_stock_only)
     cart_items = get_cart_items()
 
-    # Check cart status for each product
-    products_with_cart_status = []
-    for product in products:
-        product_dict = dict(product)
-        product_dict['in_cart'] = False
-        if current_user.is_authenticated:
-            product_dict['in_cart'] = db.execute('SELECT COUNT(*) AS count FROM cart_items WHERE name = ? AND user_id = ?', 
-                                                (product['name'], current_user.id)).fetchone()['count'] > 0
-        products_with_cart_status.append(product_dict)
+    # Check cart status for each product with one lookup of the cart's product ids
+    in_cart_ids = {item['product_id'] for item in cart_items}
+    products_with_cart_status = [
+        dict(summaries[product_id], in_cart=product_id in in_cart_ids)
+        for product_id in product_ids if product_id in summaries
+    ]
 
     return render_template(
         'search.html',
         products=products_with_cart_status,
         search_query=query,
         selected_category=category,
-        categories=categories,
+        selected_price=price,
+        in_stock_only=in_stock_only,
+        facets=facets,
         sort_by=sort_by,
         sort_order=sort_order,
+        page=page,
+        page_count=page_count,
+        total=total,
         cart_items=cart_items,
     )
 
-@app.route('/product/<int:product_id>')
-def product_detail(product_id: int):
+# Products per search results page
+SEARCH_PAGE_SIZE = 24
+
+# Largest value SQLite stores as an INTEGER
+SQLITE_MAX_INT = 2 ** 63 - 1
+
+def search_product_ids(query, category_name, bucket_index, in_stock_only, sort_by, sort_order, page):
+    """Ids of one page of search results, in order, and the total number of matches.
+
+    Cached per normalized (query, filters, sort, page) and catalog version
+    (and stock version when filtering on stock), so a repeated search costs
+    no scan; the rows themselves come from get_product_summaries(). Pages
+    past the last one return no ids and are not cached, so arbitrary page
+    numbers can't fill the cache.
+    """
+    key = ('search', catalog_version(), stock_version() if in_stock_only else None, query, category_name,
+           bucket_index, in_stock_only, sort_by, sort_order, page)
+    cached = search_cache.get(key)
+    if cached is not None:
+        metrics.incr('search_cache.hit')
+        return cached
+    metrics.incr('search_cache.miss')
+
+    condition, params = text_filter(query)
+    where = condition
+    if category_name:
+        where += ' AND category = ?'
+        params.append(category_name)
+
+    if bucket_index is not None:
+        _, _, low, high = PRICE_BUCKETS[bucket_index]
+        where += ' AND price >= ?'
+        params.append(low)
+        if high is not None:
+            where += ' AND price < ?'
+            params.append(high)
+
+    if in_stock_only:
+        where += ' AND stock > 0'
+
     db = get_db()
-    product = db.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
-    if not product:
+    offset = (page - 1) * SEARCH_PAGE_SIZE
+    rows = []
+    if offset <= SQLITE_MAX_INT:
+        # id breaks ties so pages don't overlap
+        rows = db.execute(f'''
+            SELECT id, COUNT(*) OVER () AS total FROM products
+            WHERE {where}
+            ORDER BY {sort_by} {sort_order.upper()}, id
+            LIMIT ? OFFSET ?
+        ''', params + [SEARCH_PAGE_SIZE, offset]).fetchall()
+    if rows:
+        total = rows[0]['total']
+    else:
+        total = db.execute(f'SELECT COUNT(*) FROM products WHERE {where}', params).fetchone()[0]
+        if page > 1:
+            # Past the last page; report the match count without caching
+            return [], total
+    result = ([row['id'] for row in rows], total)
+    search_cache.set(key, result)
+    return result
+
+@bp.route('/api/suggest')
+def suggest():
+    """Type-ahead suggestions for the header search box"""
+    query = request.args.get('q') or ''
+    suggest_index.ensure_current(catalog_version(), load_suggest_data)
+    return jsonify({'query': query, 'suggestions': suggest_index.lookup(query[:100])})
+
+# Columns the catalog API may return, and the default sparse fieldset
+CATALOG_API_FIELDS = ('id', 'name', 'category', 'price', 'description', 'image_url', 'stock', 'created_at')
+CATALOG_API_DEFAULT_FIELDS = ('id', 'name', 'category', 'price', 'image_url', 'stock')
+CATALOG_API_MAX_LIMIT = 200
+
+def json_bytes(payload):
+    """Serialize with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+def json_response(payload):
+    return current_app.response_class(json_bytes(payload), mimetype='application/json')
+
+def sqlite_int(value):
+    """int(value), or ValueError if it isn't an integer SQLite can store"""
+    number = int(value)
+    if not -SQLITE_MAX_INT - 1 <= number <= SQLITE_MAX_INT:
+        raise ValueError(f'{value} is out of range')
+    return number
+
+def parse_id_list(raw):
+    """Parse '1,2,3' into a list of unique ints, or None if malformed or out of range"""
+    try:
+        return list(dict.fromkeys(sqlite_int(part) for part in raw.split(',') if part.strip()))
+    except ValueError:
+        return None
+
+def catalog_query(args):
+    """SQL, parameters, output fields, selected columns and page size for a catalog API request.
+
+    Raises ValueError for invalid parameters. The page size is None for an
+    ids= batch fetch, which isn't paginated.
+    """
+    fields = [field.strip() for field in (args.get('fields') or '').split(',') if field.strip()]
+    fields = list(dict.fromkeys(fields)) or list(CATALOG_API_DEFAULT_FIELDS)
+    unknown = [field for field in fields if field not in CATALOG_API_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # The id is needed for the pagination cursor even if not requested
+    columns = fields if 'id' in fields else ['id'] + fields
+
+    if args.get('ids'):
+        ids = parse_id_list(args['ids'])
+        if ids is None or len(ids) > CATALOG_API_MAX_LIMIT:
+            raise ValueError(f'ids must be up to {CATALOG_API_MAX_LIMIT} integers')
+        placeholders = ','.join('?' * len(ids))
+        return (f'SELECT {", ".join(columns)} FROM products WHERE id IN ({placeholders}) ORDER BY id',
+                ids, fields, columns, None)
+    try:
+        after = sqlite_int(args.get('after', 0))
+        limit = min(max(int(args.get('limit', 50)), 1), CATALOG_API_MAX_LIMIT)
+    except ValueError:
+        raise ValueError('after and limit must be integers')
+    # Keyset pagination: an index seek on the primary key, however deep the page
+    return (f'SELECT {", ".join(columns)} FROM products WHERE id > ? ORDER BY id LIMIT ?',
+            (after, limit + 1), fields, columns, limit)
+
+def catalog_payload(rows, fields, columns, limit):
+    """The catalog API response body for plain tuple rows of catalog_query()"""
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1][0]
+    offset = 0 if columns is fields else 1
+    return {'products': [dict(zip(fields, row[offset:])) for row in rows], 'next_after': next_after}
+
+@bp.route('/api/products')
+def api_products():
+    """Product catalog as JSON with sparse fieldsets, batch fetch and keyset pagination.
+
+    Query parameters: fields=id,name,price  ids=1,2,3  after=<last id>  limit=<n>
+    """
+    try:
+        sql, params, fields, columns, limit = catalog_query(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    cursor = get_db().cursor()
+    cursor.row_factory = None  # plain tuples; each row becomes exactly one dict below
+    rows = cursor.execute(sql, params).fetchall()
+
+    response = json_response(catalog_payload(rows, fields, columns, limit))
+    response.add_etag()
+    return response.make_conditional(request)
+
+# Thumbnails are content-addressed, so browsers and proxies may keep them for a year
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+
+@bp.route('/thumbnails/<path:filename>')
+def thumbnail(filename):
+    """A stored video thumbnail; names change whenever the contents do, so they never go stale"""
+    response = send_from_directory(current_app.config['THUMBNAIL_DIR'], filename, max_age=THUMBNAIL_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+@bp.route('/product/<int:product_id>')
+def product_detail(product_id: int):
+    page = get_product_page(product_id)
+    if page is None:
         abort(404)
 
+    db = get_db()
     # Track recently viewed product if user is authenticated
     if current_user.is_authenticated:
         # Check if product is already in recently viewed for this user
@@ -483,58 +1113,107 @@ def product_detail(product_id: int):
             # Add to recently viewed
             db.execute('INSERT INTO recently_viewed (user_id, product_id) VALUES (?, ?)', 
                       (current_user.id, product_id))
-        
-        # Keep only the 5 most recent items for this user
-        db.execute('DELETE FROM recently_viewed WHERE user_id = ? AND id NOT IN (SELECT id FROM recently_viewed WHERE user_id = ? ORDER BY viewed_at DESC LIMIT 5)', 
-                  (current_user.id, current_user.id))
+        # Older rows are trimmed in bulk by maintenance.py
         db.commit()
 
-    detailed_description = (
-        (product['description'] or 'No description available.') +
-        ' This is a detailed overview of the instrument, its tone, build, and typical use cases.'
-    )
-
     # Check if product is already in cart
     in_cart = False
     if current_user.is_authenticated:
-        in_cart = db.execute('SELECT COUNT(*) AS count FROM cart_items WHERE name = ? AND user_id = ?', 
-                           (product['name'], current_user.id)).fetchone()['count'] > 0
-
-    # Get YouTube links if they exist
-    youtube_links = []
-    if 'youtube_links' in product.keys() and product['youtube_links']:
-        try:
-            youtube_links = json.loads(product['youtube_links'])
-        except (json.JSONDecodeError, TypeError):
-            youtube_links = []
+        in_cart = db.execute('SELECT 1 FROM cart_items WHERE user_id = ? AND product_id = ?',
+                             (current_user.id, product_id)).fetchone() is not None
+    else:
+        in_cart = product_id in get_guest_cart()
 
     cart_items = get_cart_items()
 
     return render_template(
         'product_detail.html',
+        product=page['product'],
+        content=Markup(page['content']),
+        in_cart=in_cart,
+        cart_items=cart_items,
+    )
+
+def get_product_page(product_id):
+    """The shared, visitor-independent part of a product page, or None if there is no such product.
+
+    Rendered pages are cached per worker. A page is fresh for
+    PRODUCT_PAGE_FRESH seconds and unchanged catalog version; after that it
+    is still served, up to PRODUCT_PAGE_STALE seconds old, while one
+    background load replaces it. Concurrent misses for the same product
+    wait on a single load instead of each querying and rendering.
+    """
+    key = ('product_page', product_id)
+    page = product_page_cache.get(key)
+    if page is None:
+        metrics.incr('product_page.miss')
+        return product_page_loads.do(key, lambda: load_product_page(product_id))
+    if (page['version'] != catalog_version() or
+            time.monotonic() - page['loaded_at'] > current_app.config['PRODUCT_PAGE_FRESH']):
+        metrics.incr('product_page.stale')
+        refresh = copy_current_request_context(lambda: load_product_page(product_id))
+        product_page_loads.do_in_background(key, refresh)
+    else:
+        metrics.incr('product_page.hit')
+    return page
+
+def load_product_page(product_id):
+    """Query and render the shared part of a product page and cache it."""
+    version = catalog_version()
+    loaded_at = time.monotonic()
+    db = get_db()
+    product = db.execute(
+        'SELECT id, name, category, price, description, image_url, stock FROM products WHERE id = ?',
+        (product_id,)
+    ).fetchone()
+    if not product:
+        return None
+
+    detailed_description = (
+        (product['description'] or 'No description available.') +
+        ' This is a detailed overview of the instrument, its tone, build, and typical use cases.'
+    )
+
+    # Get YouTube videos for this product, best ranked first
+    youtube_links = [
+        dict(row) for row in db.execute('''
+            SELECT v.video_id, v.title, v.channel, v.duration_seconds, v.views, v.published,
+                   t.filename AS thumbnail
+            FROM product_videos v
+            LEFT JOIN video_thumbnails t ON t.video_id = v.video_id AND t.status = 'ok'
+            WHERE v.product_id = ?
+            ORDER BY v.rank
+        ''', (product_id,)).fetchall()
+    ]
+
+    # "Customers also viewed", precomputed by recommendations.py
+    also_viewed = db.execute('''
+        SELECT p.id, p.name, p.price, p.image_url
+        FROM product_recommendations r
+        JOIN products p ON p.id = r.recommended_id
+        WHERE r.product_id = ?
+        ORDER BY r.rank
+    ''', (product_id,)).fetchall()
+
+    content = render_template(
+        'product_detail_content.html',
         product=product,
         detailed_description=detailed_description,
         youtube_links=youtube_links,
-        in_cart=in_cart,
-        cart_items=cart_items,
+        also_viewed=also_viewed,
     )
+    page = {'product': dict(product), 'content': content, 'version': version, 'loaded_at': loaded_at}
+    product_page_cache.set(('product_page', product_id), page)
+    return page
 
-@app.route('/shopping-cart')
-@login_required
+@bp.route('/shopping-cart')
 def shopping_cart():
-    db = get_db()
-    items = db.execute('''
-        SELECT ci.id, ci.name, ci.price, ci.quantity, p.image_url 
-        FROM cart_items ci
-        LEFT JOIN products p ON ci.product_id = p.id
-        WHERE ci.user_id = ? 
-        ORDER BY ci.id DESC
-    ''', (current_user.id,)).fetchall()
+    items = get_cart_items()
     total = sum((row['price'] or 0) * (row['quantity'] or 1) for row in items)
-    return render_template('shopping_cart.html', cart_items=items, cart_total=total)
+    # A fresh idempotency key per page view; retries of this checkout reuse it
+    return render_template('shopping_cart.html', cart_items=items, cart_total=total, checkout_key=uuid.uuid4().hex)
 
-@app.route('/update-cart-quantity', methods=['POST'])
-@login_required
+@bp.route('/update-cart-quantity', methods=['POST'])
 def update_cart_quantity():
     item_id = request.form.get('item_id')
     quantity = request.form.get('quantity')
@@ -548,6 +1227,9 @@ def update_cart_quantity():
             return jsonify({'success': False, 'error': 'Quantity must be at least 1'}), 400
     except (ValueError, TypeError):
         return jsonify({'success': False, 'error': 'Invalid quantity'}), 400
+
+    if not current_user.is_authenticated:
+        return update_guest_cart_quantity(item_id, quantity)
     
     db = get_db()
     try:
@@ -555,7 +1237,7 @@ def update_cart_quantity():
         item = db.execute('''
             SELECT ci.quantity, p.stock, p.price 
             FROM cart_items ci
-            LEFT JOIN products p ON ci.product_id = p.id
+            JOIN products p ON ci.product_id = p.id
             WHERE ci.id = ? AND ci.user_id = ?
         ''', (item_id, current_user.id)).fetchone()
         
@@ -567,11 +1249,15 @@ def update_cart_quantity():
             db.execute('UPDATE cart_items SET quantity = ? WHERE id = ? AND user_id = ?', 
                       (quantity, item_id, current_user.id))
             db.commit()
+            events.publish_cart(event_broker, db, current_user.id)
             
             # Calculate new item total and cart total
             new_item_total = (item['price'] or 0) * quantity
-            all_items = db.execute('SELECT price, quantity FROM cart_items WHERE user_id = ?', 
-                                  (current_user.id,)).fetchall()
+            all_items = db.execute('''
+                SELECT p.price, ci.quantity FROM cart_items ci
+                JOIN products p ON ci.product_id = p.id
+                WHERE ci.user_id = ?
+            ''', (current_user.id,)).fetchall()
             new_cart_total = sum((row['price'] or 0) * (row['quantity'] or 1) for row in all_items)
             
             return jsonify({
@@ -587,13 +1273,49 @@ def update_cart_quantity():
         db.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/add-to-cart', methods=['POST'])
-@login_required
+def update_guest_cart_quantity(item_id, quantity):
+    """Set a guest cart line's quantity; guest item ids are product ids."""
+    lines = get_guest_cart()
+    try:
+        product_id = int(item_id)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Item not found'}), 404
+    if product_id not in lines:
+        return jsonify({'success': False, 'error': 'Item not found'}), 404
+    product = get_product_summaries([product_id]).get(product_id)
+    if not product or product['stock'] <= 0 or quantity > min(product['stock'], guest_cart.MAX_QUANTITY):
+        return jsonify({'success': False, 'error': 'Insufficient stock available'}), 400
+    lines[product_id] = quantity
+    save_guest_cart()
+    cart_items = get_cart_items()
+    return jsonify({
+        'success': True,
+        'message': 'Quantity updated',
+        'new_item_total': product['price'] * quantity,
+        'new_cart_total': sum(item['price'] * item['quantity'] for item in cart_items)
+    })
+
+def add_to_guest_cart(product_id, quantity):
+    """Add to the cookie cart, checking stock against the cached catalog."""
+    product = get_product_summaries([product_id]).get(product_id)
+    if not product:
+        return jsonify({'success': False, 'error': 'Product not found'}), 404
+    lines = get_guest_cart()
+    new_quantity = lines.get(product_id, 0) + quantity
+    if product['stock'] <= 0 or new_quantity > min(product['stock'], guest_cart.MAX_QUANTITY):
+        return jsonify({'success': False, 'error': 'Insufficient stock available'}), 400
+    if not guest_cart.add_line(lines, product_id, quantity):
+        return jsonify({'success': False, 'error': 'Your cart is full. Log in to add more items.'}), 400
+    save_guest_cart()
+    message = 'Product added to cart' if new_quantity > quantity else 'Added to cart'
+    return jsonify({'success': True, 'message': message, 'quantity': new_quantity})
+
+@bp.route('/add-to-cart', methods=['POST'])
 def add_to_cart():
     product_id = request.form.get('product_id')
     quantity = request.form.get('quantity', 1)
     try:
-        quantity = int(quantity)
+        quantity = sqlite_int(quantity)
         if quantity < 1:
             quantity = 1
     except (ValueError, TypeError):
@@ -602,42 +1324,40 @@ def add_to_cart():
     if not product_id:
         return jsonify({'success': False, 'error': 'Product ID is required'}), 400
 
+    try:
+        product_id = sqlite_int(product_id)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Product not found'}), 404
+    if not current_user.is_authenticated:
+        return add_to_guest_cart(product_id, quantity)
+
     db = get_db()
     try:
-        # Fetch the product details
-        product = db.execute('SELECT name, price, stock FROM products WHERE id = ?', (product_id,)).fetchone()
+        product = db.execute('SELECT price, stock FROM products WHERE id = ?', (product_id,)).fetchone()
         if not product:
             return jsonify({'success': False, 'error': 'Product not found'}), 404
-        
-        # Check if item already exists in cart
-        existing_item = db.execute('SELECT id, quantity FROM cart_items WHERE product_id = ? AND user_id = ?', 
-                                  (product_id, current_user.id)).fetchone()
-        
-        if existing_item:
-            # Update quantity of existing item
-            new_quantity = existing_item['quantity'] + quantity
-            # Check stock availability
-            if product['stock'] > 0 and new_quantity <= product['stock']:
-                db.execute('UPDATE cart_items SET quantity = ? WHERE id = ?', (new_quantity, existing_item['id']))
-                db.commit()
-                return jsonify({'success': True, 'message': 'Product added to cart', 'quantity': new_quantity})
-            else:
-                return jsonify({'success': False, 'error': 'Insufficient stock available'}), 400
-        else:
-            # Add new item to cart
-            if product['stock'] > 0 and quantity <= product['stock']:
-                db.execute('INSERT INTO cart_items (name, price, user_id, product_id, quantity) VALUES (?, ?, ?, ?, ?)', 
-                          (product['name'], product['price'], current_user.id, product_id, quantity))
-                db.commit()
-                return jsonify({'success': True, 'message': 'Added to cart', 'quantity': quantity})
-            else:
-                return jsonify({'success': False, 'error': 'Insufficient stock available'}), 400
-                
+
+        # One upsert, so concurrent adds of the same product add up instead of racing on the
+        # unique (user_id, product_id) line; nothing changes if the total would exceed stock
+        row = db.execute('''
+            INSERT INTO cart_items (user_id, product_id, quantity, price_snapshot)
+            SELECT ?, id, ?, price FROM products WHERE id = ? AND stock >= ?
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            WHERE quantity + excluded.quantity <= (SELECT stock FROM products WHERE id = excluded.product_id)
+            RETURNING quantity
+        ''', (current_user.id, quantity, product_id, quantity)).fetchone()
+        if row is None:
+            db.rollback()
+            return jsonify({'success': False, 'error': 'Insufficient stock available'}), 400
+        db.commit()
+        events.publish_cart(event_broker, db, current_user.id)
+        message = 'Product added to cart' if row['quantity'] > quantity else 'Added to cart'
+        return jsonify({'success': True, 'message': message, 'quantity': row['quantity']})
     except Exception as e:
         db.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/product/<int:product_id>/stock', methods=['PUT'])
+@bp.route('/api/product/<int:product_id>/stock', methods=['PUT'])
 @login_required
 def update_product_stock(product_id: int):
     """Update product stock quantity (admin function)"""
@@ -662,6 +1382,8 @@ def update_product_stock(product_id: int):
         # Update stock
         db.execute('UPDATE products SET stock = ? WHERE id = ?', (new_stock, product_id))
         db.commit()
+        bump_stock_version()
+        events.publish_stock(event_broker, db, [product_id])
         
         return jsonify({
             'success': True, 
@@ -674,8 +1396,300 @@ def update_product_stock(product_id: int):
         db.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Largest batch accepted by the bulk stock endpoint, and ids per IN query
+BULK_STOCK_MAX_ITEMS = 50000
+SQLITE_IN_CHUNK = 500
+
+def read_bulk_stock_items():
+    """Stock updates from a JSON body (list or {"items": [...]}) or streamed NDJSON"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        # Parse line by line as the body streams in instead of buffering it whole
+        items = []
+        for line in request.stream:
+            if line.strip():
+                items.append(json.loads(line))
+                if len(items) > BULK_STOCK_MAX_ITEMS:
+                    # Stop reading; the request is rejected anyway
+                    raise ValueError(f'At most {BULK_STOCK_MAX_ITEMS} updates per request')
+        return items
+    data = request.get_json()
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('Expected a list of stock updates')
+    return data
+
+def parse_stock_update(item):
+    """Validate one update into (product_id, mode, value) or raise ValueError"""
+    if not isinstance(item, dict) or 'product_id' not in item:
+        raise ValueError('product_id is required')
+    try:
+        product_id = sqlite_int(item['product_id'])
+    except (ValueError, TypeError):
+        raise ValueError('Invalid product_id')
+    if ('stock' in item) == ('delta' in item):
+        raise ValueError('Exactly one of stock or delta is required')
+    mode = 'stock' if 'stock' in item else 'delta'
+    try:
+        value = sqlite_int(item[mode])
+    except (ValueError, TypeError):
+        raise ValueError(f'Invalid {mode}')
+    if mode == 'stock' and value < 0:
+        raise ValueError('Stock cannot be negative')
+    return product_id, mode, value
+
+@bp.route('/api/products/stock', methods=['POST'])
+@login_required
+def bulk_update_stock():
+    """Apply many absolute or relative stock updates in one transaction (inventory sync).
+
+    Items look like {"product_id": 1, "stock": 25} or {"product_id": 1, "delta": -2}
+    and are applied in order; each gets its own result entry.
+    """
+    try:
+        items = read_bulk_stock_items()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e) or 'Invalid request body'}), 400
+    if len(items) > BULK_STOCK_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'At most {BULK_STOCK_MAX_ITEMS} updates per request'}), 400
+
+    results = []
+    updates = []
+    for item in items:
+        try:
+            product_id, mode, value = parse_stock_update(item)
+        except ValueError as e:
+            results.append({'product_id': item.get('product_id') if isinstance(item, dict) else None,
+                            'success': False, 'error': str(e)})
+            continue
+        results.append({'product_id': product_id, 'success': True})
+        updates.append((len(results) - 1, product_id, mode, value))
+
+    db = get_db()
+    try:
+        # Take the write lock up front so deltas apply to stock nobody else is changing
+        db.execute('BEGIN IMMEDIATE')
+        product_ids = list({product_id for _, product_id, _, _ in updates})
+        current = {}
+        for start in range(0, len(product_ids), SQLITE_IN_CHUNK):
+            chunk = product_ids[start:start + SQLITE_IN_CHUNK]
+            rows = db.execute(f'SELECT id, stock FROM products WHERE id IN ({",".join("?" * len(chunk))})',
+                              chunk).fetchall()
+            current.update((row['id'], row['stock'] or 0) for row in rows)
+
+        new_stock = {}
+        for result_index, product_id, mode, value in updates:
+            result = results[result_index]
+            if product_id not in current:
+                result.update(success=False, error='Product not found')
+                continue
+            old_stock = new_stock.get(product_id, current[product_id])
+            stock = value if mode == 'stock' else old_stock + value
+            if stock < 0:
+                result.update(success=False, error='Stock cannot be negative', old_stock=old_stock)
+                continue
+            if stock > SQLITE_MAX_INT:
+                result.update(success=False, error='Stock is out of range', old_stock=old_stock)
+                continue
+            new_stock[product_id] = stock
+            result.update(old_stock=old_stock, new_stock=stock)
+
+        db.executemany('UPDATE products SET stock = ? WHERE id = ?',
+                       [(stock, product_id) for product_id, stock in new_stock.items()])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    if new_stock:
+        bump_stock_version()
+        events.publish_stock(event_broker, db, new_stock)
+    failed = sum(1 for result in results if not result['success'])
+    return jsonify({
+        'success': True,
+        'updated': len(new_stock),
+        'failed': failed,
+        'results': results,
+    })
+
+@bp.route('/checkout', methods=['POST'])
+@login_required
+def checkout():
+    """Order the contents of the cart.
+
+    Requires an Idempotency-Key header (or idempotency_key form field);
+    retrying with the same key returns the same order. Answers 201 once the
+    order is placed, 409 if it was rejected for lack of stock, or 202 with a
+    status URL if it is still queued after CHECKOUT_WAIT seconds.
+    """
+    idempotency_key = (request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or '').strip()
+    if not idempotency_key or len(idempotency_key) > 64:
+        return jsonify({'success': False, 'error': 'An idempotency key of up to 64 characters is required'}), 400
+
+    db = get_db()
+    order = orders.get_order(db, current_user.id, idempotency_key)
+    created = order is None
+    if order is None:
+        lines = [(row['product_id'], row['quantity']) for row in db.execute(
+            'SELECT product_id, quantity FROM cart_items WHERE user_id = ? ORDER BY product_id', (current_user.id,)
+        ).fetchall()]
+        if not lines:
+            return jsonify({'success': False, 'error': 'Your cart is empty'}), 400
+        try:
+            future = order_writer.submit(current_user.id, idempotency_key, lines)
+        except orders.CheckoutBusyError:
+            response = jsonify({'success': False, 'error': 'Checkout is busy. Please try again in a moment.'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        try:
+            order = future.result(timeout=current_app.config['CHECKOUT_WAIT'])
+        except FutureTimeoutError:
+            return order_status_response(None, idempotency_key)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+    return order_status_response(order, idempotency_key, created)
+
+@bp.route('/api/orders/<idempotency_key>')
+@login_required
+def order_status(idempotency_key):
+    """Poll a checkout by its idempotency key"""
+    order = orders.get_order(get_db(), current_user.id, idempotency_key)
+    if order is None and not order_writer.is_pending(current_user.id, idempotency_key):
+        return jsonify({'success': False, 'error': 'Order not found'}), 404
+    return order_status_response(order, idempotency_key)
+
+def order_status_response(order, idempotency_key, created=False):
+    """201/200 for a placed order, 409 for a rejected one, 202 while it is queued"""
+    if order is None:
+        return jsonify({
+            'success': True,
+            'status': 'queued',
+            'status_url': url_for('.order_status', idempotency_key=idempotency_key),
+        }), 202
+    if order['status'] == orders.STATUS_REJECTED:
+        return jsonify({'success': False, 'status': order['status'], 'error': order['error'], 'order': order}), 409
+    return jsonify({'success': True, 'status': order['status'], 'order': order}), 201 if created else 200
+
+def event_stream_params():
+    """The product ids an /api/events request watches and the logged-in user id, or ValueError"""
+    product_ids = parse_id_list(request.args.get('products', ''))
+    if product_ids is None:
+        raise ValueError('products must be a comma-separated list of ids')
+    if len(product_ids) > events.MAX_PRODUCTS:
+        raise ValueError(f'At most {events.MAX_PRODUCTS} products per stream')
+    user_id = current_user.id if current_user.is_authenticated else None
+    if not product_ids and user_id is None:
+        raise ValueError('Nothing to watch')
+    return product_ids, user_id
+
+def event_stream_topics(product_ids, user_id):
+    topics = [events.stock_topic(product_id) for product_id in product_ids]
+    if user_id is not None:
+        topics.append(events.cart_topic(user_id))
+    return topics
+
+@bp.route('/api/events')
+def event_stream():
+    """Server-sent events: stock levels of ?products=1,2,3 and the logged-in user's cart summary.
+
+    Sends the current state on connect, then each change. Every
+    EVENTS_HEARTBEAT seconds without one, the state is re-read (catching
+    writes made in other workers) and a heartbeat comment sent if nothing changed.
+    404 unless LIVE_UPDATES is set.
+    """
+    if not current_app.config['LIVE_UPDATES']:
+        return jsonify({'success': False, 'error': 'Live updates are disabled'}), 404
+    try:
+        product_ids, user_id = event_stream_params()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        subscription = event_broker.subscribe(event_stream_topics(product_ids, user_id))
+    except events.TooManySubscribersError as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.headers['Retry-After'] = str(events.RETRY_MS // 1000)
+        return response, 503
+    heartbeat = current_app.config['EVENTS_HEARTBEAT']
+
+    @stream_with_context
+    def generate():
+        stream = events.EventStream()
+        yield stream.open(events.snapshot(get_db(), product_ids, user_id))
+        while True:
+            received = subscription.wait(heartbeat)
+            if received:
+                chunk = stream.events(received)
+            else:
+                chunk = stream.idle(events.snapshot(get_db(), product_ids, user_id))
+            if chunk:
+                yield chunk
+
+    response = current_app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(subscription.close)
+    return response
+
+@bp.route('/api/metrics')
+@login_required
+def metrics_snapshot():
+    """Return this worker's in-process metrics (admin function)"""
+    return jsonify(metrics.snapshot())
+
+@bp.route('/api/profile', methods=['GET', 'POST'])
+@login_required
+def profile():
+    """This worker's sampled stacks in folded format, for flame graphs (admin function)
+
+    POST a JSON body with any of sample_rate, endpoints (list of endpoint
+    names) and reset (true clears the stacks) to change this worker's settings.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if 'sample_rate' in data:
+            try:
+                sample_rate = float(data['sample_rate'])
+            except (ValueError, TypeError):
+                sample_rate = -1
+            if not 0 <= sample_rate <= 1:
+                return jsonify({'success': False, 'error': 'sample_rate must be between 0 and 1'}), 400
+            current_app.config['PROFILE_SAMPLE_RATE'] = sample_rate
+        if 'endpoints' in data:
+            endpoints = data['endpoints']
+            if not isinstance(endpoints, list) or not all(isinstance(name, str) for name in endpoints):
+                return jsonify({'success': False, 'error': 'endpoints must be a list of endpoint names'}), 400
+            current_app.config['PROFILE_ENDPOINTS'] = frozenset(endpoints)
+        if data.get('reset'):
+            profiler.reset()
+        return jsonify({
+            'success': True,
+            'sample_rate': current_app.config['PROFILE_SAMPLE_RATE'],
+            'endpoints': sorted(current_app.config['PROFILE_ENDPOINTS']),
+            **profiler.stats(),
+        })
+    response = current_app.response_class(profiler.folded(), mimetype='text/plain')
+    for name, value in profiler.stats().items():
+        response.headers[f'X-Profile-{name.title()}'] = str(value)
+    return response
+
+@bp.route('/api/backups', methods=['GET', 'POST'])
+@login_required
+def backups():
+    """List database snapshots, or start an online backup in the background (admin function)"""
+    if request.method == 'POST':
+        name = backup_job.start(current_app.config['DATABASE'])
+        if name is None:
+            return jsonify({'success': False, 'error': 'A backup is already running'}), 409
+        return jsonify({'success': True, 'snapshot': name}), 202
+    return jsonify({
+        'running': backup_job.running,
+        'last_result': backup_job.last_result,
+        'snapshots': list_snapshots(current_app.config['BACKUP_DIR']),
+    })
+
 # --- Authentication Routes ---
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username'].strip()
@@ -699,6 +1713,8 @@ def register():
         if not email:
             errors.append('Email is required')
         else:
+            # Imported on first registration; it's slow to import and rarely needed
+            from email_validator import validate_email, EmailNotValidError
             try:
                 validate_email(email)
             except EmailNotValidError as e:
@@ -735,16 +1751,20 @@ def register():
             return render_template('register.html', errors=errors, username=username, email=email)
         
         # Create new user
+        try:
+            password_hash = password_hasher.hash(password)
+        except HasherBusyError:
+            return render_template('register.html', errors=['The server is busy. Please try again in a moment.'],
+                                   username=username, email=email), 503, {'Retry-After': '1'}
         try:
             db = get_db()
-            password_hash = generate_password_hash(password)
             db.execute(
                 'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
                 (username, email, password_hash)
             )
             db.commit()
             flash('Registration successful! Please log in.')
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
         except sqlite3.IntegrityError as e:
             db.rollback()
             if 'UNIQUE constraint failed: users.username' in str(e):
@@ -761,7 +1781,7 @@ def register():
     
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'GET':
         return render_template('login.html')
@@ -775,27 +1795,51 @@ def login():
     
     db = get_db()
     
-    # Find user by username or email
-    user = db.execute('SELECT * FROM users WHERE username = ? OR email = ?', 
-                     (username_or_email, username_or_email)).fetchone()
+    # Find user by email or username; usernames can't contain '@', so one unique index answers it
+    lookup_column = 'email' if '@' in username_or_email else 'username'
+    user = db.execute(f'SELECT id, username, email, password_hash, session_version FROM users WHERE {lookup_column} = ?',
+                      (username_or_email,)).fetchone()
+    
+    # Turn away floods before doing any password hashing; an account's username and email share one limit
+    rejected_by = login_throttle.check(request.remote_addr or 'unknown', username_or_email, user['id'] if user else None)
+    if rejected_by:
+        metrics.incr(f'login.rejected.{rejected_by}')
+        return render_template('login.html', error='Too many login attempts. Please wait a minute and try again.'), 429
     
-    if not user or not check_password_hash(user['password_hash'], password):
-        return render_template('login.html', error='Invalid username/email or password')
+    try:
+        if not user or not password_hasher.verify(user['password_hash'], password):
+            metrics.incr('login.failed')
+            return render_template('login.html', error='Invalid username/email or password')
+        # Transparently upgrade hashes made with old parameters while we have the password
+        new_hash = password_hasher.hash(password) if password_hasher.needs_rehash(user['password_hash']) else None
+    except HasherBusyError:
+        return render_template('login.html', error='The server is busy. Please try again in a moment.'), 503, \
+            {'Retry-After': '1'}
     
     # Update last login
-    db.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user['id'],))
+    if new_hash:
+        db.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP, password_hash = ? WHERE id = ?',
+                   (new_hash, user['id']))
+        metrics.incr('password_hash.rehashed')
+    else:
+        db.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user['id'],))
+    merge_guest_cart(user['id'])
     db.commit()
     
     # Log the user in
-    login_user(User(user['id'], user['username'], user['email'], user['password_hash']), remember=remember)
+    login_throttle.succeeded(username_or_email, user['id'])
+    metrics.incr('login.succeeded')
+    invalidate_user(user['id'])
+    login_user(User(user['id'], user['username'], user['email'], user['session_version']), remember=remember)
     
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
-@app.route('/logout', methods=['POST'])
+@bp.route('/logout', methods=['POST'])
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,314 @@
+"""
+ASGI serving mode for Guitar Store
+
+Serves the app from an ASGI server's event loop so concurrency is no
+longer capped by the number of worker threads: connections waiting on a
+client or in a queue cost a coroutine, not a thread. Blocking work runs on
+two bounded thread pools whose threads each keep one SQLite connection
+open for their lifetime:
+
+- /api/products and /api/suggest are answered natively; their queries are
+  awaited on the read pool and the JSON is written from the event loop
+- /api/events streams are native too, so an open stream costs a coroutine
+  rather than a thread
+- the read-heavy pages (/, /search, /product/<id>) run their Flask views,
+  queries and template rendering on the read pool
+- every other route (login, cart changes, checkout, admin) runs on the
+  fallback pool, so a burst of writes or password hashes can't take the
+  threads pages are rendered on
+
+Usage:
+    uvicorn --factory asgi:create_asgi_app --workers 4 --port 5001
+    hypercorn "asgi:create_asgi_app()" --workers 4 --bind 0.0.0.0:5001
+"""
+
+import asyncio
+import io
+import os
+import re
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import generate_etag, parse_etags, quote_etag
+
+import app as app_module
+import events
+from cache import catalog_version
+
+# Threads (and SQLite connections) for the native handlers and read-heavy pages
+READ_THREADS = 16
+
+# Threads for every other route
+FALLBACK_THREADS = 8
+
+# Pages whose Flask views run on the read pool
+READ_PATHS = re.compile(r'^/(?:|index\.html|search|product/\d+)$')
+
+
+class ConnectionPool:
+    """SQLite connections kept open by long-lived worker threads, one per thread.
+
+    Threads of executors made by executor() open their connection on first
+    use; app.get_db() hands it to Flask views running on them instead of
+    opening one per request.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _adopt_thread(self) -> None:
+        self._local.pooled = True
+
+    def executor(self, size: int, name: str) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(size, thread_name_prefix=name, initializer=self._adopt_thread)
+
+    def on_pool_thread(self) -> bool:
+        return getattr(self._local, 'pooled', False)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+
+def wsgi_environ(scope: dict, body: bytes) -> dict:
+    """Build a WSGI environ for an ASGI HTTP request."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI carries the decoded path as latin-1 code points of its UTF-8 bytes
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            value = f"{environ[name]}{'; ' if name == 'HTTP_COOKIE' else ','}{value}"
+        environ[name] = value
+    return environ
+
+
+def run_wsgi(wsgi_app: Callable, environ: dict) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """Call a WSGI app and return its status code, headers and buffered body."""
+    response = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return chunks.append
+
+    result = wsgi_app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    status, headers = response
+    return (int(status.split(' ', 1)[0]),
+            [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            b''.join(chunks))
+
+
+async def read_body(receive: Callable) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def wait_for_disconnect(receive: Callable) -> None:
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def header(scope: dict, name: bytes) -> Optional[str]:
+    for raw_name, raw_value in scope.get('headers', []):
+        if raw_name.lower() == name:
+            return raw_value.decode('latin-1')
+    return None
+
+
+class AsyncApp:
+    """ASGI application wrapping a Flask app built by app.create_app()."""
+
+    def __init__(self, flask_app, read_threads: int = READ_THREADS, fallback_threads: int = FALLBACK_THREADS):
+        self.flask_app = flask_app
+        self.pool = ConnectionPool(flask_app.config['DATABASE'])
+        flask_app.extensions['db_pool'] = self.pool
+        self.read_executor = self.pool.executor(read_threads, 'asgi-read')
+        self.fallback_executor = self.pool.executor(fallback_threads, 'asgi-fallback')
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] != 'http':
+            await send({'type': 'websocket.close'})
+        elif scope['method'] in ('GET', 'HEAD') and scope['path'] == '/api/products':
+            await self.catalog(scope, send)
+        elif scope['method'] in ('GET', 'HEAD') and scope['path'] == '/api/suggest':
+            await self.suggest(scope, send)
+        elif scope['method'] == 'GET' and scope['path'] == '/api/events':
+            await self.event_stream(scope, receive, send)
+        elif scope['method'] in ('GET', 'HEAD') and READ_PATHS.match(scope['path']):
+            await self.call_flask(scope, receive, send, self.read_executor)
+        else:
+            await self.call_flask(scope, receive, send, self.fallback_executor)
+
+    async def lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.read_executor.shutdown(wait=False)
+                self.fallback_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run(self, executor: ThreadPoolExecutor, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def fetchall(self, sql: str, params=(), row_factory=sqlite3.Row) -> list:
+        """Run a query on the read pool's connection and return its rows."""
+        def query():
+            cursor = self.pool.connection().cursor()
+            cursor.row_factory = row_factory
+            return cursor.execute(sql, params).fetchall()
+        return await self.run(self.read_executor, query)
+
+    async def call_flask(self, scope: dict, receive: Callable, send: Callable, executor: ThreadPoolExecutor) -> None:
+        body = await read_body(receive)
+        status, headers, content = await self.run(executor, run_wsgi, self.flask_app, wsgi_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def send_json(self, scope: dict, send: Callable, status: int, payload: dict,
+                        extra_headers: Optional[list] = None) -> None:
+        body = app_module.json_bytes(payload)
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers + (extra_headers or [])})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+    async def catalog(self, scope: dict, send: Callable) -> None:
+        """GET /api/products, answered like app.api_products() including its ETag"""
+        args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('utf-8', 'replace'), keep_blank_values=True))
+        try:
+            sql, params, fields, columns, limit = app_module.catalog_query(args)
+        except ValueError as e:
+            await self.send_json(scope, send, 400, {'success': False, 'error': str(e)})
+            return
+        rows = await self.fetchall(sql, params, row_factory=None)
+        payload = app_module.catalog_payload(rows, fields, columns, limit)
+        etag = generate_etag(app_module.json_bytes(payload))
+        if parse_etags(header(scope, b'if-none-match')).contains(etag):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': [(b'etag', quote_etag(etag).encode())]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await self.send_json(scope, send, 200, payload, [(b'etag', quote_etag(etag).encode())])
+
+    async def suggest(self, scope: dict, send: Callable) -> None:
+        """GET /api/suggest; the index is rebuilt on the read pool only after a catalog change"""
+        args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('utf-8', 'replace'), keep_blank_values=True))
+        query = args.get('q') or ''
+        index = self.flask_app.extensions['suggest_index']
+        if index.version != catalog_version():
+            def rebuild():
+                with self.flask_app.app_context():
+                    index.ensure_current(catalog_version(), app_module.load_suggest_data)
+            await self.run(self.read_executor, rebuild)
+        await self.send_json(scope, send, 200, {'query': query, 'suggestions': index.lookup(query[:100])})
+
+
+    async def event_stream(self, scope: dict, receive: Callable, send: Callable) -> None:
+        """GET /api/events, streamed like app.event_stream()"""
+        if not self.flask_app.config['LIVE_UPDATES']:
+            await self.send_json(scope, send, 404, {'success': False, 'error': 'Live updates are disabled'})
+            return
+        environ = wsgi_environ(scope, b'')
+
+        def params():
+            # Runs the login check, so needs a request context
+            with self.flask_app.request_context(environ):
+                return app_module.event_stream_params()
+
+        try:
+            product_ids, user_id = await self.run(self.read_executor, params)
+        except ValueError as e:
+            await self.send_json(scope, send, 400, {'success': False, 'error': str(e)})
+            return
+
+        def snapshot():
+            return events.snapshot(self.pool.connection(), product_ids, user_id)
+
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        try:
+            subscription = self.flask_app.extensions['event_broker'].subscribe(
+                app_module.event_stream_topics(product_ids, user_id),
+                notify=lambda: loop.call_soon_threadsafe(ready.set))
+        except events.TooManySubscribersError as e:
+            await self.send_json(scope, send, 503, {'success': False, 'error': str(e)},
+                                 [(b'retry-after', str(events.RETRY_MS // 1000).encode())])
+            return
+
+        heartbeat = self.flask_app.config['EVENTS_HEARTBEAT']
+        stream = events.EventStream()
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            chunk = stream.open(await self.run(self.read_executor, snapshot))
+            while True:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+                woken = asyncio.ensure_future(ready.wait())
+                done, _ = await asyncio.wait({woken, disconnected}, timeout=heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if disconnected in done:
+                    return
+                if woken in done:
+                    ready.clear()
+                    chunk = stream.events(subscription.drain())
+                else:
+                    chunk = stream.idle(await self.run(self.read_executor, snapshot))
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+
+def create_asgi_app(config=None, read_threads: int = READ_THREADS, fallback_threads: int = FALLBACK_THREADS) -> AsyncApp:
+    """Build the Flask app with app.create_app(config) and wrap it for an ASGI server
+
+    Live update streams are cheap here, so LIVE_UPDATES defaults to on.
+    """
+    config = {'LIVE_UPDATES': os.environ.get('LIVE_UPDATES', '1') != '0', **(config or {})}
+    return AsyncApp(app_module.create_app(config), read_threads, fallback_threads)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Serving benchmark for Guitar Store: threaded WSGI against asgi.py
+
+Drives both paths in-process with the same closed-loop clients (each sends
+its next request when the previous response has been written) over a mix
+of the read-heavy endpoints, against a copy of the database:
+
+- wsgi: the Flask app on a pool of --threads server threads, as a threaded
+  WSGI server would run it; a thread is held until the response is written
+- asgi: asgi.AsyncApp called from the event loop; its thread pools
+  only run the views and queries
+
+--client-delay adds the time spent writing each response to a slow client
+(sleeping in the server thread for WSGI, awaited in send() for ASGI), which
+is where a thread-per-request server runs out of threads.
+
+Usage:
+    python benchmarks/serving.py
+    python benchmarks/serving.py --concurrency 1000 --requests 20000 --client-delay 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app as app_module  # noqa: E402
+import asgi  # noqa: E402
+
+PATHS = [
+    '/',
+    '/product/1',
+    '/product/2',
+    '/product/3',
+    '/search?q=gibson',
+    '/search?category=electric&sort=price',
+    '/api/products?limit=50',
+    '/api/products?fields=id,name,price&after=10',
+    '/api/suggest?q=gi',
+]
+
+
+def make_scope(path: str, cookie: str) -> dict:
+    url = urlsplit(path)
+    return {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url.path,
+        'raw_path': url.path.encode(),
+        'query_string': url.query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 50000),
+        'server': ('localhost', 5001),
+    }
+
+
+def log_in(flask_app, db_path: str) -> str:
+    """Create and log in a benchmark user; returns the session cookie header."""
+    # Inserted directly, since registration checks the email domain over DNS
+    conn = sqlite3.connect(db_path)
+    conn.execute('INSERT OR IGNORE INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                 ('bench', 'bench@example.com', generate_password_hash('bench-pass')))
+    conn.commit()
+    conn.close()
+    client = flask_app.test_client()
+    client.post('/login', data={'username_or_email': 'bench', 'password': 'bench-pass'})
+    cookie = client.get_cookie('session')
+    return f'session={cookie.value}' if cookie else ''
+
+
+async def run_clients(handle, concurrency: int, total: int) -> tuple:
+    """Run `concurrency` closed-loop clients until `total` requests are done."""
+    latencies, statuses = [], Counter()
+    sent = 0
+
+    async def client():
+        nonlocal sent
+        while sent < total:
+            path = PATHS[sent % len(PATHS)]
+            sent += 1
+            start = time.perf_counter()
+            statuses[await handle(path)] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, statuses
+
+
+async def bench_wsgi(flask_app, cookie: str, args) -> tuple:
+    server = ThreadPoolExecutor(args.threads)
+    loop = asyncio.get_running_loop()
+
+    def serve(path):
+        status, _, _ = asgi.run_wsgi(flask_app, asgi.wsgi_environ(make_scope(path, cookie), b''))
+        if args.client_delay:
+            time.sleep(args.client_delay)
+        return status
+
+    try:
+        return await run_clients(lambda path: loop.run_in_executor(server, serve, path),
+                                 args.concurrency, args.requests)
+    finally:
+        server.shutdown()
+
+
+async def bench_asgi(asgi_app, cookie: str, args) -> tuple:
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def handle(path):
+        status = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif args.client_delay:
+                await asyncio.sleep(args.client_delay)
+
+        await asgi_app(make_scope(path, cookie), receive, send)
+        return status[0]
+
+    return await run_clients(handle, args.concurrency, args.requests)
+
+
+def report(label: str, threads: int, elapsed: float, latencies: list, statuses: Counter) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+    print(f"{label:<6}{threads:>9}{len(latencies) / elapsed:>12,.0f}"
+          f"{statistics.median(latencies) * 1000:>12.1f}{p99 * 1000:>12.1f}   {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the threaded WSGI and ASGI serving paths.')
+    parser.add_argument('--concurrency', type=int, default=200, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=5000, help='total requests')
+    parser.add_argument('--threads', type=int, default=32, help='WSGI server threads')
+    parser.add_argument('--read-threads', type=int, default=asgi.READ_THREADS, help='ASGI read pool threads')
+    parser.add_argument('--client-delay', type=float, default=0.0,
+                        help='seconds spent writing each response to the client')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'instance', 'cart.db'),
+                        help='database to copy for the benchmark')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'cart.db')
+        shutil.copy(args.db, db_path)
+        config = {'DATABASE': db_path, 'JINJA_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+                  'SHARED_CACHE_DB': os.path.join(workdir, 'cache.db'), 'PASSWORD_HASH_WORKERS': 0}
+        flask_app = app_module.create_app(config)
+        asgi_app = asgi.AsyncApp(flask_app, read_threads=args.read_threads)
+        cookie = log_in(flask_app, db_path)
+
+        print(f"{args.requests:,} requests, {args.concurrency} clients, "
+              f"{args.client_delay * 1000:.0f} ms client delay; latency in milliseconds")
+        print(f"{'path':<6}{'threads':>9}{'req/s':>12}{'p50':>12}{'p99':>12}   statuses")
+        report('wsgi', args.threads, *asyncio.run(bench_wsgi(flask_app, cookie, args)))
+        report('asgi', args.read_threads, *asyncio.run(bench_asgi(asgi_app, cookie, args)))
+
+
+if __name__ == "__main__":
+    main()
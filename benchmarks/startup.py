@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Worker startup benchmark for Guitar Store
+
+Starts fresh interpreters, as a pre-forked server restarting its workers
+would, and times each startup phase: importing app, create_app() (database
+setup, cache and template warm-up) and the first two requests to /. Runs
+against a copy of the database, once with an empty Jinja bytecode cache
+and then with the cache filled by the first run.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --db instance/cart.db
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line of phase timings
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app({"DATABASE": sys.argv[1], "JINJA_CACHE_DIR": sys.argv[2],
+                             "PASSWORD_HASH_WORKERS": 0, "WARM_UP": sys.argv[3] == "1"})
+created = time.perf_counter()
+client = app.test_client()
+client.get("/")
+first = time.perf_counter()
+client.get("/")
+second = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "first_request": first - created,
+    "second_request": second - first,
+    "total": second - start,
+}))
+'''
+
+PHASES = ('import', 'create_app', 'first_request', 'second_request', 'total')
+
+
+def run_once(db_path: str, cache_dir: str, warm_up: bool) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, db_path, cache_dir, '1' if warm_up else '0'],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(label: str, samples: list) -> None:
+    medians = {phase: statistics.median(sample[phase] for sample in samples) * 1000 for phase in PHASES}
+    print(f"{label:<28}" + ''.join(f"{medians[phase]:>16.1f}" for phase in PHASES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure worker startup time phase by phase.')
+    parser.add_argument('--runs', type=int, default=5, help='interpreters started per scenario')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'instance', 'cart.db'),
+                        help='database to copy for the benchmark')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'cart.db')
+        shutil.copy(args.db, db_path)
+        cache_dir = os.path.join(workdir, 'jinja_cache')
+
+        print(f"Median of {args.runs} runs, milliseconds")
+        print(f"{'scenario':<28}" + ''.join(f"{phase:>16}" for phase in PHASES))
+        scenarios = [
+            ('no warm-up, cold cache', False, True),
+            ('warm-up, cold cache', True, True),
+            ('warm-up, bytecode cached', True, False),
+        ]
+        for label, warm_up, clear_cache in scenarios:
+            samples = []
+            for _ in range(args.runs):
+                if clear_cache:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                samples.append(run_once(db_path, cache_dir, warm_up))
+            report(label, samples)
+
+
+if __name__ == "__main__":
+    main()
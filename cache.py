@@ -0,0 +1,341 @@
+"""
+Caching helpers for Guitar Store
+
+Small, thread-safe building blocks shared by the request handlers. Every
+cache has the same get/set/pop/clear interface:
+
+- TTLCache lives in a single worker process
+- SQLiteCache is a shared tier in a local SQLite file, seen by every
+  worker process on the host
+- TieredCache puts a per-process TTLCache in front of a shared tier
+- SingleFlight coalesces concurrent loads of the same key into one call
+
+The catalog version can likewise live in a memory-mapped file, so a product
+write in one worker (or a CLI such as catalog_io.py) invalidates catalog
+caches in all of them without any external service.
+"""
+
+import logging
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows; the catalog version then stays per process
+    fcntl = None
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Shared cache tier in a local SQLite file, seen by every worker process on the host.
+
+    Keys are stored by repr() and values pickled, so both must be plain
+    Python data. Expired rows are pruned every `prune_every` sets.
+    """
+
+    def __init__(self, path: str, ttl: float = 300.0, max_entries: int = 10000, prune_every: int = 500):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._sets = 0
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID'
+            )
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        row = self._conn().execute(
+            'SELECT value, expires_at FROM cache_entries WHERE key = ?', (repr(key),)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+            (repr(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + self.ttl)
+        )
+        self._sets += 1
+        if self._sets % self.prune_every == 0:
+            self.prune()
+
+    def prune(self) -> None:
+        """Drop expired entries, then the soonest-expiring ones beyond max_entries."""
+        conn = self._conn()
+        conn.execute('DELETE FROM cache_entries WHERE expires_at < ?', (time.time(),))
+        conn.execute(
+            'DELETE FROM cache_entries WHERE key IN ('
+            'SELECT key FROM cache_entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self.get(key, default)
+        self._conn().execute('DELETE FROM cache_entries WHERE key = ?', (repr(key),))
+        return value
+
+    def clear(self) -> None:
+        self._conn().execute('DELETE FROM cache_entries')
+
+
+class TieredCache:
+    """A per-process TTLCache in front of an optional shared tier.
+
+    Shared-tier errors (e.g. a locked cache file) count as misses rather
+    than failing the request.
+    """
+
+    def __init__(self, local: TTLCache, shared: Optional[SQLiteCache] = None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.shared is None:
+            return default
+        try:
+            value = self.shared.get(key, _MISSING)
+        except sqlite3.Error:
+            metrics.incr('cache.shared_errors')
+            return default
+        if value is _MISSING:
+            return default
+        metrics.incr('cache.shared_hits')
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except sqlite3.Error:
+                metrics.incr('cache.shared_errors')
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self.local.pop(key, default)
+        if self.shared is not None:
+            try:
+                self.shared.pop(key)
+            except sqlite3.Error:
+                metrics.incr('cache.shared_errors')
+        return value
+
+    def clear(self) -> None:
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs at most one load per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._calls: "dict[Hashable, _Call]" = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Call fn, or wait for the call already in flight for key and return (or raise) its outcome."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.incr('single_flight.coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def do_in_background(self, key: Hashable, fn: Callable[[], Any]) -> bool:
+        """Start fn in a thread unless a call for key is in flight; returns whether it started."""
+        with self._lock:
+            if key in self._calls:
+                return False
+            call = self._calls[key] = _Call()
+
+        def run():
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                logger.exception(f"Background load of {key!r} failed")
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        threading.Thread(target=run, name='single-flight', daemon=True).start()
+        return True
+
+
+class SharedCounter:
+    """64-bit counters in a memory-mapped file, shared by every process that maps it.
+
+    Reads are a single unlocked load from the mapping; increments take a
+    POSIX record lock (held per process, so it still excludes forked
+    workers) plus a thread lock.
+    """
+
+    def __init__(self, path: str, slots: int = 1):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < 8 * slots:
+            os.ftruncate(self._fd, 8 * slots)
+        self._map = mmap.mmap(self._fd, 8 * slots)
+        self._lock = threading.Lock()
+
+    def value(self, slot: int = 0) -> int:
+        return struct.unpack_from('<Q', self._map, 8 * slot)[0]
+
+    def increment(self, slot: int = 0) -> int:
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                value = self.value(slot) + 1
+                struct.pack_into('<Q', self._map, 8 * slot, value)
+                return value
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+# The catalog version is incremented on every product write except stock
+# changes, which increment the stock version instead; caches derived from
+# the catalog include the versions they depend on in their keys, so stale
+# entries are never served and sales don't throw away name, category and
+# price caches. Kept in this process until configure_catalog_version()
+# points them at a shared file.
+CATALOG_SLOT = 0
+STOCK_SLOT = 1
+_versions = [0, 0]
+_catalog_version_lock = threading.Lock()
+_shared_catalog_version: Optional[SharedCounter] = None
+
+# Counter file kept next to the database
+CATALOG_VERSION_FILENAME = 'catalog_version'
+
+
+def configure_catalog_version(path: Optional[str]) -> None:
+    """Share the catalog version through the counter file at path (None keeps it per process)."""
+    global _shared_catalog_version
+    if path and fcntl is not None:
+        if _shared_catalog_version is None or _shared_catalog_version.path != path:
+            _shared_catalog_version = SharedCounter(path, slots=len(_versions))
+    else:
+        _shared_catalog_version = None
+
+
+def _version(slot: int) -> int:
+    if _shared_catalog_version is not None:
+        return _shared_catalog_version.value(slot)
+    return _versions[slot]
+
+
+def _bump_version(slot: int) -> int:
+    if _shared_catalog_version is not None:
+        return _shared_catalog_version.increment(slot)
+    with _catalog_version_lock:
+        _versions[slot] += 1
+        return _versions[slot]
+
+
+def catalog_version() -> int:
+    return _version(CATALOG_SLOT)
+
+
+def bump_catalog_version() -> int:
+    return _bump_version(CATALOG_SLOT)
+
+
+def stock_version() -> int:
+    return _version(STOCK_SLOT)
+
+
+def bump_stock_version() -> int:
+    return _bump_version(STOCK_SLOT)
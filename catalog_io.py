@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Bulk catalog import/export for Guitar Store
+
+Streams products between the database and CSV or JSON Lines files without
+holding the whole catalog in memory. Imports upsert by SKU in chunks, one
+transaction per chunk, and can drop the secondary indexes on products for
+the duration of a large load and rebuild them once at the end.
+
+Usage:
+    python catalog_io.py import products.csv
+    python catalog_io.py import products.jsonl --chunk-size 5000 --rebuild-indexes
+    python catalog_io.py export products.csv
+    python catalog_io.py export - --format jsonl > products.jsonl
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+# A CSV row, or a JSON Lines line still to be decoded
+Record = Union[Dict, str]
+
+from cache import CATALOG_VERSION_FILENAME, bump_catalog_version, bump_stock_version, configure_catalog_version
+
+DB_PATH = os.path.join('instance', 'cart.db')
+
+# Columns exchanged with files, in file order
+COLUMNS = ('sku', 'name', 'category', 'price', 'description', 'image_url', 'stock')
+REQUIRED_COLUMNS = ('sku', 'name', 'category', 'price')
+
+# Largest stock SQLite can store as an INTEGER
+MAX_STOCK = 2 ** 63 - 1
+
+UPSERT_SQL = '''
+    INSERT INTO products (sku, name, category, price, description, image_url, stock)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(sku) DO UPDATE SET
+        name = excluded.name,
+        category = excluded.category,
+        price = excluded.price,
+        description = excluded.description,
+        image_url = excluded.image_url,
+        stock = excluded.stock
+'''
+
+
+def get_db_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Create and return a database connection in autocommit mode."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Add the sku column and its unique index if the app hasn't created them yet."""
+    columns = [col['name'] for col in conn.execute('PRAGMA table_info(products)').fetchall()]
+    if 'sku' not in columns:
+        conn.execute('ALTER TABLE products ADD COLUMN sku TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products (sku)')
+
+
+def detect_format(path: str, fmt: Optional[str]) -> str:
+    """Use the explicit format, or infer it from the file extension."""
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Record]]:
+    """Yield (line number, record) per product record, reading the file lazily.
+
+    JSON Lines records are yielded undecoded, so a malformed line is
+    rejected by to_row() like any other invalid record.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_number, line
+
+
+def text_field(record: Dict, column: str) -> Optional[str]:
+    """A text column as a string, or None if empty; JSON numbers are accepted (e.g. numeric SKUs)."""
+    value = record.get(column)
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'{column} must be text')
+    return str(value).strip() or None
+
+
+def number_field(record: Dict, column: str) -> Optional[float]:
+    """A numeric column as a finite float, or None if empty; accepts numbers and numeric strings."""
+    value = record.get(column)
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'{column} must be a number')
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f'{column} must be a finite number')
+    return number
+
+
+def stock_field(record: Dict) -> int:
+    """The stock column as an int SQLite can store; empty means 0."""
+    value = record.get('stock')
+    if value is None or value == '':
+        return 0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise ValueError('stock must be a whole number')
+    stock = int(value)
+    if not 0 <= stock <= MAX_STOCK:
+        raise ValueError('stock is out of range')
+    return stock
+
+
+def to_row(record: Record) -> Tuple:
+    """Convert a file record to an upsert parameter tuple, or raise ValueError.
+
+    Every field is type-checked here, so nothing that fails to bind or
+    violates a constraint reaches the chunk's transaction.
+    """
+    if isinstance(record, str):
+        record = json.loads(record)
+    if not isinstance(record, dict):
+        raise ValueError('record is not a JSON object')
+    row = {column: text_field(record, column) for column in ('sku', 'name', 'category', 'description', 'image_url')}
+    row['price'] = number_field(record, 'price')
+    missing = [column for column in REQUIRED_COLUMNS if row[column] is None]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    stock = stock_field(record)
+    return (
+        row['sku'],
+        row['name'],
+        row['category'],
+        row['price'],
+        row['description'],
+        row['image_url'],
+        stock,
+    )
+
+
+def secondary_indexes(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """Return (name, sql) of the non-unique indexes on products.
+
+    Unique indexes stay in place: the SKU upsert depends on one.
+    """
+    indexes = []
+    for index in conn.execute("PRAGMA index_list(products)").fetchall():
+        if index['unique'] or index['origin'] != 'c':
+            continue
+        sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (index['name'],)
+        ).fetchone()['sql']
+        indexes.append((index['name'], sql))
+    return indexes
+
+
+def import_products(conn: sqlite3.Connection, records: Iterable[Tuple[int, Record]], chunk_size: int = 1000,
+                    rebuild_indexes: bool = False, log: TextIO = sys.stderr) -> Dict[str, float]:
+    """Upsert (line number, record) pairs into products in chunked transactions and return load statistics.
+
+    Invalid records, including malformed JSON, are skipped and logged with their line number.
+    """
+    dropped = []
+    if rebuild_indexes:
+        dropped = secondary_indexes(conn)
+        for name, _ in dropped:
+            conn.execute(f'DROP INDEX {name}')
+        if dropped:
+            print(f"Dropped indexes for the load: {', '.join(name for name, _ in dropped)}", file=log)
+
+    start = time.perf_counter()
+    imported = skipped = 0
+    records = iter(records)
+    try:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            rows = []
+            for line_number, record in chunk:
+                try:
+                    rows.append(to_row(record))
+                except (ValueError, TypeError, KeyError) as e:
+                    skipped += 1
+                    print(f"Skipping line {line_number}: {e}", file=log)
+            conn.execute('BEGIN')
+            try:
+                conn.executemany(UPSERT_SQL, rows)
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+            imported += len(rows)
+            elapsed = time.perf_counter() - start
+            print(f"Imported {imported} products ({imported / elapsed:,.0f} rows/sec)", file=log)
+    finally:
+        # Rebuild even after a failed chunk so queries don't lose their indexes
+        if dropped:
+            index_start = time.perf_counter()
+            for _, sql in dropped:
+                conn.execute(sql)
+            print(f"Rebuilt indexes in {time.perf_counter() - index_start:.2f}s", file=log)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'imported': imported,
+        'skipped': skipped,
+        'seconds': elapsed,
+        'rows_per_second': imported / elapsed if elapsed else 0.0,
+    }
+
+
+def export_products(conn: sqlite3.Connection, stream: TextIO, fmt: str) -> int:
+    """Write every product to stream, one row at a time, and return the row count."""
+    cursor = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM products ORDER BY id")
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(COLUMNS)
+        for row in cursor:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in cursor:
+            stream.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+            stream.write('\n')
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import or export the product catalog.')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', help="CSV or JSONL file, or '-' for stdin/stdout")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='file format (default: from extension)')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='rows per transaction when importing')
+    parser.add_argument('--rebuild-indexes', action='store_true',
+                        help='drop secondary indexes during the import and rebuild them afterwards')
+    args = parser.parse_args()
+
+    fmt = detect_format(args.path, args.format)
+    conn = get_db_connection(args.db)
+    try:
+        ensure_schema(conn)
+        if args.command == 'import':
+            stream = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+            with stream:
+                stats = import_products(conn, read_records(stream, fmt), args.chunk_size, args.rebuild_indexes)
+            # Invalidate catalog caches in running app workers
+            configure_catalog_version(os.path.join(os.path.dirname(os.path.abspath(args.db)),
+                                                   CATALOG_VERSION_FILENAME))
+            bump_catalog_version()
+            bump_stock_version()
+            print(f"Done: {stats['imported']} imported, {stats['skipped']} skipped in "
+                  f"{stats['seconds']:.2f}s ({stats['rows_per_second']:,.0f} rows/sec)", file=sys.stderr)
+        else:
+            start = time.perf_counter()
+            stream = sys.stdout if args.path == '-' else open(args.path, 'w', newline='', encoding='utf-8')
+            with stream:
+                count = export_products(conn, stream, fmt)
+            elapsed = time.perf_counter() - start
+            print(f"Done: {count} exported in {elapsed:.2f}s "
+                  f"({count / elapsed if elapsed else 0:,.0f} rows/sec)", file=sys.stderr)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Online backup and restore for Guitar Store
+
+Snapshots instance/cart.db with the SQLite online backup API while the app
+keeps running. Pages are copied a step at a time and the backup pauses
+between steps, so writers are only held up for the duration of one step;
+the snapshot is still a consistent copy of the database. Snapshots can be
+gzip-compressed, and restore copies one back into the live database the
+same way after checking its integrity.
+
+Usage:
+    python db_backup.py backup backups/
+    python db_backup.py backup backups/cart.db.gz --pages 512 --pause 0.02
+    python db_backup.py restore backups/cart-20250101-030000.db.gz
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from cache import CATALOG_VERSION_FILENAME, bump_catalog_version, bump_stock_version, configure_catalog_version
+
+DB_PATH = os.path.join('instance', 'cart.db')
+
+# Pages copied per step; at the default 4 KiB page size, 1 MiB
+PAGES_PER_STEP = 256
+
+# Seconds to pause between steps so writers can get in
+STEP_PAUSE = 0.005
+
+# A write by another connection restarts a stepped backup from the first
+# page; after this many restarts the rest is copied in a single step
+MAX_RESTARTS = 3
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def snapshot_name(compress: bool, now: Optional[datetime] = None) -> str:
+    stamp = (now or datetime.now()).strftime('%Y%m%d-%H%M%S')
+    return f"cart-{stamp}.db{'.gz' if compress else ''}"
+
+
+def _copy(source: sqlite3.Connection, target: sqlite3.Connection,
+          pages_per_step: int, pause: float) -> Dict[str, int]:
+    """Run the backup API step by step, pausing between steps.
+
+    Under constant writes the stepped copy would never finish, so after
+    MAX_RESTARTS restarts it falls back to one step, which holds the
+    source's read lock until the copy is done.
+    """
+    steps = restarts = total_pages = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, total_pages, last_remaining
+        steps += 1
+        total_pages = total
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        source.backup(target, pages=pages_per_step, progress=progress)
+        single_step = False
+    except _TooManyRestarts:
+        source.backup(target, pages=-1)
+        steps += 1
+        single_step = True
+    return {'pages': total_pages, 'steps': steps, 'restarts': restarts, 'single_step': single_step}
+
+
+def backup(db_path: str, dest: str, pages_per_step: int = PAGES_PER_STEP,
+           pause: float = STEP_PAUSE, compress: Optional[bool] = None) -> Dict:
+    """Snapshot db_path to dest and return timings.
+
+    dest may be a directory, in which case a timestamped name is used. The
+    snapshot is compressed if compress is set or dest ends in .gz.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, snapshot_name(bool(compress)))
+    compress = dest.endswith('.gz') if compress is None else compress
+    if compress and not dest.endswith('.gz'):
+        dest += '.gz'
+    raw_path = dest[:-3] if compress else dest
+    # Write to a temporary name so a failed run never leaves a partial snapshot
+    partial_path = raw_path + '.partial'
+
+    start = time.perf_counter()
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(partial_path)
+    try:
+        copied = _copy(source, target, pages_per_step, pause)
+    finally:
+        target.close()
+        source.close()
+    backup_seconds = time.perf_counter() - start
+
+    compress_seconds = 0.0
+    if compress:
+        compress_start = time.perf_counter()
+        with open(partial_path, 'rb') as raw, gzip.open(dest + '.partial', 'wb', compresslevel=6) as packed:
+            shutil.copyfileobj(raw, packed, 1024 * 1024)
+        os.remove(partial_path)
+        os.replace(dest + '.partial', dest)
+        compress_seconds = time.perf_counter() - compress_start
+    else:
+        os.replace(partial_path, dest)
+
+    return {
+        'path': dest,
+        'bytes': os.path.getsize(dest),
+        'pages': copied['pages'],
+        'steps': copied['steps'],
+        'restarts': copied['restarts'],
+        'single_step': copied['single_step'],
+        'backup_seconds': round(backup_seconds, 3),
+        'compress_seconds': round(compress_seconds, 3),
+        'total_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def restore(snapshot: str, db_path: str, pages_per_step: int = PAGES_PER_STEP,
+            pause: float = STEP_PAUSE) -> Dict:
+    """Copy a snapshot (optionally .gz) over db_path after an integrity check."""
+    start = time.perf_counter()
+    source_path = snapshot
+    if snapshot.endswith('.gz'):
+        source_path = db_path + '.restore'
+        with gzip.open(snapshot, 'rb') as packed, open(source_path, 'wb') as raw:
+            shutil.copyfileobj(packed, raw, 1024 * 1024)
+    try:
+        source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+        try:
+            result = source.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f'snapshot failed integrity check: {result}')
+            target = sqlite3.connect(db_path)
+            try:
+                copied = _copy(source, target, pages_per_step, pause)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    finally:
+        if source_path != snapshot:
+            os.remove(source_path)
+    return {
+        'path': db_path,
+        'pages': copied['pages'],
+        'steps': copied['steps'],
+        'total_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def list_snapshots(directory: str) -> List[Dict]:
+    """Return the snapshots in directory, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for name in os.listdir(directory):
+        if name.startswith('cart-') and name.endswith(('.db', '.db.gz')):
+            stat = os.stat(os.path.join(directory, name))
+            snapshots.append({'name': name, 'bytes': stat.st_size, 'modified': stat.st_mtime})
+    return sorted(snapshots, key=lambda snapshot: snapshot['modified'], reverse=True)
+
+
+class BackupJob:
+    """Runs one background backup at a time for the admin endpoint."""
+
+    def __init__(self, directory: str, compress: bool = True):
+        self.directory = directory
+        self.compress = compress
+        self.running = False
+        self.last_result: Optional[Dict] = None
+        self._lock = threading.Lock()
+
+    def start(self, db_path: str) -> Optional[str]:
+        """Start backing up db_path and return the snapshot name, or None if a backup is running."""
+        with self._lock:
+            if self.running:
+                return None
+            self.running = True
+        os.makedirs(self.directory, exist_ok=True)
+        name = snapshot_name(self.compress)
+        thread = threading.Thread(target=self._run, args=(db_path, os.path.join(self.directory, name)),
+                                  name='db-backup', daemon=True)
+        thread.start()
+        return name
+
+    def _run(self, db_path: str, dest: str) -> None:
+        try:
+            self.last_result = {'success': True, **backup(db_path, dest, compress=self.compress)}
+        except (sqlite3.Error, OSError) as e:
+            self.last_result = {'success': False, 'error': str(e), 'path': dest}
+        finally:
+            self.running = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up or restore the Guitar Store database while it is in use.')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    backup_parser = subcommands.add_parser('backup', help='write a snapshot of the database')
+    backup_parser.add_argument('dest', help='snapshot file, or a directory for a timestamped name')
+    backup_parser.add_argument('--gzip', action='store_true', help='compress the snapshot (implied by a .gz name)')
+    restore_parser = subcommands.add_parser('restore', help='copy a snapshot over the database')
+    restore_parser.add_argument('snapshot', help='snapshot file (.db or .db.gz)')
+    for subparser in (backup_parser, restore_parser):
+        subparser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+        subparser.add_argument('--pages', type=int, default=PAGES_PER_STEP, help='pages copied per step')
+        subparser.add_argument('--pause', type=float, default=STEP_PAUSE, help='seconds to pause between steps')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'backup':
+            result = backup(args.db, args.dest, args.pages, args.pause, compress=args.gzip or None)
+            if result['single_step']:
+                print(f"Restarted {result['restarts']} times by concurrent writes; copied the rest in one step",
+                      file=sys.stderr)
+            print(f"Backed up {result['pages']:,} pages in {result['steps']} steps to {result['path']} "
+                  f"({result['bytes'] / 1024:,.0f} KiB): backup {result['backup_seconds']:.2f}s, "
+                  f"compress {result['compress_seconds']:.2f}s, total {result['total_seconds']:.2f}s",
+                  file=sys.stderr)
+        else:
+            result = restore(args.snapshot, args.db, args.pages, args.pause)
+            # Invalidate catalog caches in running app workers
+            configure_catalog_version(os.path.join(os.path.dirname(os.path.abspath(args.db)),
+                                                   CATALOG_VERSION_FILENAME))
+            bump_catalog_version()
+            bump_stock_version()
+            print(f"Restored {result['pages']:,} pages in {result['steps']} steps into {result['path']} "
+                  f"in {result['total_seconds']:.2f}s", file=sys.stderr)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
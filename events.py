@@ -0,0 +1,204 @@
+"""
+Live stock and cart updates for Guitar Store
+
+Write paths publish to an in-process EventBroker: the current stock level
+of a product on ('stock', product_id) and the cart summary of a user on
+('cart', user_id). Each /api/events stream subscribes to the products its
+page shows and to its user's cart, and relays what it receives as
+server-sent events.
+
+A subscription keeps only the latest event per topic, so a slow client
+gets the current stock level rather than every intermediate one, and its
+memory is bounded by the topics it watches. The broker caps the number of
+subscriptions, since each open stream holds a server thread (or a
+coroutine under asgi.py) for as long as the page is open.
+
+The broker lives in one worker process. Between heartbeats a stream
+re-reads the state it watches, which also picks up writes made by other
+workers and CLI jobs, and only sends what changed since it last wrote it.
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import metrics
+
+# Open streams allowed per worker
+MAX_SUBSCRIBERS = 256
+
+# Seconds between heartbeats (and re-reads of the watched state) on an idle stream
+HEARTBEAT = 15.0
+
+# Milliseconds browsers wait before reconnecting a dropped stream
+RETRY_MS = 5000
+
+# Products one stream may watch
+MAX_PRODUCTS = 50
+
+Event = Tuple[Hashable, dict]
+
+
+class TooManySubscribersError(Exception):
+    """Raised when a worker already has its maximum number of open streams."""
+
+
+def stock_topic(product_id: int) -> tuple:
+    return ('stock', product_id)
+
+
+def cart_topic(user_id: int) -> tuple:
+    return ('cart', user_id)
+
+
+class Subscription:
+    """Events for a set of topics, coalesced to the latest one per topic until drained."""
+
+    def __init__(self, broker: 'EventBroker', topics: Iterable[Hashable], notify: Optional[Callable[[], None]] = None):
+        self.broker = broker
+        self.topics = frozenset(topics)
+        # Called after every put, e.g. to wake an event loop
+        self._notify = notify
+        self._pending: "OrderedDict[Hashable, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def put(self, topic: Hashable, data: dict) -> None:
+        with self._lock:
+            self._pending.pop(topic, None)
+            self._pending[topic] = data
+        self._ready.set()
+        if self._notify is not None:
+            self._notify()
+
+    def drain(self) -> List[Event]:
+        """Return and clear the pending events, oldest first."""
+        with self._lock:
+            self._ready.clear()
+            events = list(self._pending.items())
+            self._pending.clear()
+        return events
+
+    def wait(self, timeout: float) -> List[Event]:
+        """Block until an event arrives or timeout seconds pass, then drain."""
+        self._ready.wait(timeout)
+        return self.drain()
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """Topic-based publish/subscribe between the threads of one worker process."""
+
+    def __init__(self, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._subscriptions: Dict[Hashable, set] = {}
+        self._open: set = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics: Iterable[Hashable], notify: Optional[Callable[[], None]] = None) -> Subscription:
+        subscription = Subscription(self, topics, notify)
+        with self._lock:
+            if len(self._open) >= self.max_subscribers:
+                metrics.incr('events.rejected')
+                raise TooManySubscribersError('Too many open event streams')
+            self._open.add(subscription)
+            for topic in subscription.topics:
+                self._subscriptions.setdefault(topic, set()).add(subscription)
+        metrics.set_gauge('events.subscribers', len(self._open))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription not in self._open:
+                return
+            self._open.discard(subscription)
+            for topic in subscription.topics:
+                subscribers = self._subscriptions[topic]
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[topic]
+        metrics.set_gauge('events.subscribers', len(self._open))
+
+    def has_subscribers(self, topic: Hashable) -> bool:
+        """Whether anyone watches topic; lets publishers skip building unwanted events."""
+        return topic in self._subscriptions
+
+    def publish(self, topic: Hashable, data: dict) -> int:
+        """Deliver data to every subscription of topic; returns how many got it."""
+        with self._lock:
+            subscribers = list(self._subscriptions.get(topic, ()))
+        for subscription in subscribers:
+            subscription.put(topic, data)
+        if subscribers:
+            metrics.incr('events.published')
+        return len(subscribers)
+
+
+# --- State queries; connections may use any row factory ---
+
+def stock_levels(conn: sqlite3.Connection, product_ids: List[int]) -> List[Event]:
+    if not product_ids:
+        return []
+    rows = conn.execute(
+        f'SELECT id, stock FROM products WHERE id IN ({",".join("?" * len(product_ids))})', product_ids
+    ).fetchall()
+    return [(stock_topic(row[0]), {'product_id': row[0], 'stock': row[1] or 0}) for row in rows]
+
+
+def cart_summary(conn: sqlite3.Connection, user_id: int) -> Event:
+    row = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(ci.quantity), 0), COALESCE(SUM(COALESCE(p.price, 0) * ci.quantity), 0)
+        FROM cart_items ci
+        JOIN products p ON p.id = ci.product_id
+        WHERE ci.user_id = ?
+    ''', (user_id,)).fetchone()
+    return cart_topic(user_id), {'lines': row[0], 'quantity': row[1], 'total': round(row[2], 2)}
+
+
+def snapshot(conn: sqlite3.Connection, product_ids: List[int], user_id: Optional[int]) -> List[Event]:
+    """Current state of everything a stream watches."""
+    events = stock_levels(conn, product_ids)
+    if user_id is not None:
+        events.append(cart_summary(conn, user_id))
+    return events
+
+
+def publish_stock(broker: EventBroker, conn: sqlite3.Connection, product_ids: Iterable[int]) -> None:
+    """Publish the stock level of each product someone is watching; call after committing."""
+    watched = [product_id for product_id in set(product_ids) if broker.has_subscribers(stock_topic(product_id))]
+    for topic, data in stock_levels(conn, watched):
+        broker.publish(topic, data)
+
+
+def publish_cart(broker: EventBroker, conn: sqlite3.Connection, user_id: int) -> None:
+    """Publish a user's cart summary if any of their pages is watching it; call after committing."""
+    if broker.has_subscribers(cart_topic(user_id)):
+        broker.publish(*cart_summary(conn, user_id))
+
+
+# --- Server-sent events ---
+
+class EventStream:
+    """Formats one client's events, leaving out values it has already been sent."""
+
+    def __init__(self):
+        self._sent: Dict[Hashable, dict] = {}
+
+    def open(self, events: List[Event]) -> str:
+        return f'retry: {RETRY_MS}\n\n' + self.events(events)
+
+    def events(self, events: List[Event]) -> str:
+        chunks = []
+        for topic, data in events:
+            if self._sent.get(topic) != data:
+                self._sent[topic] = data
+                chunks.append(f'event: {topic[0]}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n')
+        return ''.join(chunks)
+
+    def idle(self, events: List[Event]) -> str:
+        """After a quiet heartbeat interval: changes found by re-reading the state, or a heartbeat comment."""
+        return self.events(events) or ': heartbeat\n\n'
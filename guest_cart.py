@@ -0,0 +1,56 @@
+"""
+Cookie-backed carts for anonymous visitors
+
+A guest cart is an ordered list of (product id, quantity) pairs stored in a
+signed cookie, e.g. "12_1-4_2" for product 12 x1 and product 4 x2. Reading
+it costs no database access; the lines are merged into cart_items in one
+batch when the visitor logs in. The cookie is bounded by MAX_LINES and
+MAX_QUANTITY, and a tampered or malformed cookie reads as an empty cart.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from itsdangerous import BadSignature, Signer
+
+COOKIE_NAME = 'guest_cart'
+MAX_LINES = 25
+MAX_QUANTITY = 99
+MAX_AGE = 30 * 24 * 3600  # 30 days
+
+Lines = "OrderedDict[int, int]"
+
+
+class GuestCartCodec:
+    """Signs and parses the compact guest cart cookie value."""
+
+    def __init__(self, secret_key: str):
+        self._signer = Signer(secret_key, salt='guest-cart')
+
+    def loads(self, value: Optional[str]) -> Lines:
+        """Return the cart lines in a cookie value, or an empty cart if it is invalid."""
+        lines: Lines = OrderedDict()
+        if not value:
+            return lines
+        try:
+            payload = self._signer.unsign(value).decode('ascii')
+        except (BadSignature, UnicodeDecodeError):
+            return lines
+        for pair in payload.split('-') if payload else ():
+            product_id, _, quantity = pair.partition('_')
+            if not (product_id.isdigit() and quantity.isdigit()):
+                return OrderedDict()
+            add_line(lines, int(product_id), int(quantity))
+        return lines
+
+    def dumps(self, lines: Dict[int, int]) -> str:
+        payload = '-'.join(f'{product_id}_{quantity}' for product_id, quantity in lines.items())
+        return self._signer.sign(payload).decode('ascii')
+
+
+def add_line(lines: Lines, product_id: int, quantity: int) -> bool:
+    """Add quantity of a product, returning False if the cart is full."""
+    if product_id not in lines and len(lines) >= MAX_LINES:
+        return False
+    lines[product_id] = max(1, min(MAX_QUANTITY, lines.get(product_id, 0) + quantity))
+    return True
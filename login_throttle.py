@@ -0,0 +1,187 @@
+"""
+Login attempt throttling for Guitar Store
+
+Token-bucket rate limiting for login attempts, checked before any password
+hashing so credential-stuffing floods are turned away cheaply. Buckets are
+kept in memory; an optional SQLite-backed store keeps them across restarts
+and shares them between worker processes on one host. If that store can't
+be used (e.g. it stays locked), attempts are allowed rather than failing
+the login. Buckets that have refilled carry no state and are pruned every
+PRUNE_INTERVAL seconds, so made-up identifiers don't accumulate.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Bucket = Tuple[float, float]  # (tokens, updated_at)
+
+# Seconds between prunes of refilled buckets
+PRUNE_INTERVAL = 60.0
+
+
+def refilled(bucket: Bucket, capacity: float, refill_rate: float, now: float) -> float:
+    tokens, updated_at = bucket
+    return min(capacity, tokens + max(now - updated_at, 0) * refill_rate)
+
+
+def spend(bucket: Optional[Bucket], capacity: float, refill_rate: float, now: float) -> Tuple[Bucket, bool]:
+    """Refill a bucket (a missing one starts full) and take a token if there is one.
+
+    Returns the new bucket and whether a token was taken.
+    """
+    tokens = refilled(bucket or (capacity, now), capacity, refill_rate, now)
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    return (tokens, now), allowed
+
+
+class MemoryBucketStore:
+    """Keeps buckets in a bounded in-memory mapping, dropping the oldest first."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Bucket]" = OrderedDict()
+
+    def take(self, key: str, capacity: float, refill_rate: float, now: float) -> bool:
+        """Spend a token from key's bucket; the caller serializes calls."""
+        self._buckets[key], allowed = spend(self._buckets.get(key), capacity, refill_rate, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def delete(self, key: str) -> None:
+        self._buckets.pop(key, None)
+
+    def prune(self, prefix: str, capacity: float, refill_rate: float, now: float) -> int:
+        """Drop full buckets of keys starting with prefix; returns how many."""
+        full = [key for key, bucket in self._buckets.items()
+                if key.startswith(prefix) and refilled(bucket, capacity, refill_rate, now) >= capacity]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+
+class SQLiteBucketStore:
+    """Persists buckets in a SQLite table so limits survive restarts and are shared by workers."""
+
+    def __init__(self, db_path: str, timeout: float = 1.0):
+        self._conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS login_throttle (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def take(self, key: str, capacity: float, refill_rate: float, now: float) -> bool:
+        """Spend a token from key's bucket in one write transaction, so workers can't spend the same token."""
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._conn.execute(
+                'SELECT tokens, updated_at FROM login_throttle WHERE bucket_key = ?', (key,)
+            ).fetchone()
+            bucket, allowed = spend(tuple(row) if row else None, capacity, refill_rate, now)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO login_throttle (bucket_key, tokens, updated_at) VALUES (?, ?, ?)',
+                (key, *bucket)
+            )
+            self._conn.execute('COMMIT')
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+            raise
+        return allowed
+
+    def delete(self, key: str) -> None:
+        self._conn.execute('DELETE FROM login_throttle WHERE bucket_key = ?', (key,))
+
+    def prune(self, prefix: str, capacity: float, refill_rate: float, now: float) -> int:
+        """Delete full buckets of keys starting with prefix; returns how many."""
+        return self._conn.execute(
+            '''DELETE FROM login_throttle
+               WHERE substr(bucket_key, 1, ?) = ? AND tokens + MAX(? - updated_at, 0) * ? >= ?''',
+            (len(prefix), prefix, now, refill_rate, capacity)
+        ).rowcount
+
+
+class TokenBucketLimiter:
+    """Allows bursts of `capacity` attempts, refilling at `per_minute` tokens a minute.
+
+    Keys are stored under `prefix`, so limiters with different rates can share a store.
+    """
+
+    def __init__(self, capacity: float, per_minute: float, store=None, prefix: str = ''):
+        self.capacity = capacity
+        self.refill_rate = per_minute / 60.0
+        self.store = store or MemoryBucketStore()
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._pruned_at = time.time()
+
+    def allow(self, key: str) -> bool:
+        """Take one token for key, returning False if the bucket is empty."""
+        now = time.time()
+        with self._lock:
+            try:
+                if now - self._pruned_at >= PRUNE_INTERVAL:
+                    self._pruned_at = now
+                    metrics.incr('login_throttle.pruned', self.store.prune(self.prefix, self.capacity,
+                                                                            self.refill_rate, now))
+                return self.store.take(self.prefix + key, self.capacity, self.refill_rate, now)
+            except sqlite3.Error:
+                # Fail open: a locked throttle store shouldn't turn logins into errors
+                logger.warning("Login throttle store unavailable; allowing attempt", exc_info=True)
+                metrics.incr('login_throttle.store_errors')
+                return True
+
+    def reset(self, key: str) -> None:
+        """Forget a key's history, e.g. after a successful login."""
+        with self._lock:
+            try:
+                self.store.delete(self.prefix + key)
+            except sqlite3.Error:
+                logger.warning("Login throttle store unavailable; bucket not reset", exc_info=True)
+                metrics.incr('login_throttle.store_errors')
+
+
+class LoginThrottle:
+    """Per-IP and per-account limits applied to every login attempt."""
+
+    def __init__(self, ip_burst: float = 20, ip_per_minute: float = 10,
+                 account_burst: float = 5, account_per_minute: float = 1,
+                 persist_path: Optional[str] = None):
+        store_factory = (lambda: SQLiteBucketStore(persist_path)) if persist_path else MemoryBucketStore
+        self.by_ip = TokenBucketLimiter(ip_burst, ip_per_minute, store_factory(), prefix='ip:')
+        self.by_account = TokenBucketLimiter(account_burst, account_per_minute, store_factory(), prefix='account:')
+
+    @staticmethod
+    def account_key(identifier: str, user_id: Optional[int] = None) -> str:
+        """An existing account's id, so its username and email share one bucket; else what was typed."""
+        if user_id is not None:
+            return f'user:{user_id}'
+        return f'name:{identifier.strip().lower()}'
+
+    def check(self, ip: str, identifier: str, user_id: Optional[int] = None) -> Optional[str]:
+        """Return 'ip' or 'account' if the attempt should be rejected, else None.
+
+        Pass the id of the account identifier names, if there is one.
+        """
+        if not self.by_ip.allow(ip):
+            return 'ip'
+        if not self.by_account.allow(self.account_key(identifier, user_id)):
+            return 'account'
+        return None
+
+    def succeeded(self, identifier: str, user_id: Optional[int] = None) -> None:
+        self.by_account.reset(self.account_key(identifier, user_id))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Database retention and compaction for Guitar Store
+
+Keeps the hot per-user tables small so their scans and indexes stay fast:
+
+- trims recently_viewed to the newest rows per user in one bulk DELETE
+  (product pages no longer trim on every view)
+- archives carts untouched for --cart-days days into cart_archive, one
+  compact JSON row per cart, and removes their cart_items lines
+- runs PRAGMA optimize, an incremental vacuum and wal_checkpoint(TRUNCATE)
+- reports row counts and on-disk size per table
+
+A cart is untouched when no line was added to it and its owner hasn't
+logged in since the cutoff. Incremental vacuum needs auto_vacuum set to
+INCREMENTAL, which an existing database only picks up after a full VACUUM;
+run once with --enable-incremental-vacuum to convert it.
+
+Run once from cron:
+    python maintenance.py --once
+
+Or as a long-lived background job:
+    python maintenance.py --daemon --interval 86400
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join('instance', 'cart.db')
+
+# Recently viewed rows kept per user; the home page shows five
+RECENTLY_VIEWED_KEEP = 5
+
+# Carts untouched for this long are archived
+CART_RETENTION_DAYS = 90
+
+# Free pages returned to the filesystem per run (0 = all)
+VACUUM_PAGES = 0
+
+# PRAGMA auto_vacuum values
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def get_db_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Create and return a database connection."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the cart archive table."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cart_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            items TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def trim_recently_viewed(conn: sqlite3.Connection, keep: int = RECENTLY_VIEWED_KEEP) -> int:
+    """Delete all but the newest `keep` rows per user and return the number deleted."""
+    cursor = conn.execute('''
+        DELETE FROM recently_viewed WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id ORDER BY viewed_at DESC, id DESC
+                ) AS position
+                FROM recently_viewed
+            )
+            WHERE position > ?
+        )
+    ''', (keep,))
+    conn.commit()
+    return cursor.rowcount
+
+
+def archive_abandoned_carts(conn: sqlite3.Connection, days: int = CART_RETENTION_DAYS) -> Dict[str, int]:
+    """Move carts untouched for `days` days into cart_archive.
+
+    Each archived cart becomes one row whose items column holds
+    [[product_id, quantity, price_snapshot], ...].
+    """
+    cutoff = f'-{days} days'
+    conn.execute('DROP TABLE IF EXISTS temp.abandoned_users')
+    conn.execute('''
+        CREATE TEMP TABLE abandoned_users AS
+        SELECT ci.user_id
+        FROM cart_items ci
+        LEFT JOIN users u ON u.id = ci.user_id
+        GROUP BY ci.user_id
+        HAVING MAX(ci.created_at) < datetime('now', ?)
+           AND COALESCE(MAX(u.last_login), '') < datetime('now', ?)
+    ''', (cutoff, cutoff))
+    try:
+        rows = conn.execute('''
+            SELECT user_id, json_group_array(json_array(product_id, quantity, price_snapshot)) AS items,
+                   COUNT(*) AS lines
+            FROM cart_items
+            WHERE user_id IN (SELECT user_id FROM temp.abandoned_users)
+            GROUP BY user_id
+        ''').fetchall()
+        conn.executemany('INSERT INTO cart_archive (user_id, items) VALUES (?, ?)',
+                         [(row['user_id'], row['items']) for row in rows])
+        conn.execute('DELETE FROM cart_items WHERE user_id IN (SELECT user_id FROM temp.abandoned_users)')
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return {'carts': len(rows), 'lines': sum(row['lines'] for row in rows)}
+
+
+def compact(conn: sqlite3.Connection, vacuum_pages: int = VACUUM_PAGES) -> Dict[str, int]:
+    """Refresh planner statistics, release free pages and truncate the WAL."""
+    conn.execute('PRAGMA optimize')
+    freed = 0
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})').fetchall()
+        freed = before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    else:
+        logger.info("auto_vacuum is not INCREMENTAL; run with --enable-incremental-vacuum to reclaim free pages")
+    # Returns (busy, wal pages, checkpointed pages); all -1 outside WAL mode
+    busy, wal_pages, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    return {'pages_freed': freed, 'wal_busy': busy, 'wal_pages': max(wal_pages, 0)}
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    """Switch the database to incremental auto_vacuum; rewrites the whole file."""
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+
+
+def table_sizes(conn: sqlite3.Connection) -> List[Dict]:
+    """Return row count and bytes used (table plus its indexes) for each table."""
+    tables = [row['name'] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    ).fetchall()]
+    try:
+        sizes = {row['tbl_name']: row['bytes'] for row in conn.execute('''
+            SELECT m.tbl_name, SUM(s.pgsize) AS bytes
+            FROM dbstat s JOIN sqlite_master m ON m.name = s.name
+            GROUP BY m.tbl_name
+        ''').fetchall()}
+    except sqlite3.OperationalError:
+        # SQLite built without the dbstat virtual table
+        sizes = {}
+    return [
+        {
+            'table': table,
+            'rows': conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0],
+            'bytes': sizes.get(table),
+        }
+        for table in tables
+    ]
+
+
+def log_table_sizes(conn: sqlite3.Connection) -> None:
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    logger.info(f"Database: {pages * page_size / 1024:,.0f} KiB, {free_pages * page_size / 1024:,.0f} KiB free")
+    for size in table_sizes(conn):
+        kib = f"{size['bytes'] / 1024:,.0f} KiB" if size['bytes'] is not None else 'size unknown'
+        logger.info(f"  {size['table']}: {size['rows']:,} rows, {kib}")
+
+
+def run_maintenance(conn: sqlite3.Connection, keep_recent: int = RECENTLY_VIEWED_KEEP,
+                    cart_days: int = CART_RETENTION_DAYS, vacuum_pages: int = VACUUM_PAGES) -> Dict[str, int]:
+    """Run every retention and compaction step and return a summary."""
+    ensure_schema(conn)
+    trimmed = trim_recently_viewed(conn, keep_recent)
+    archived = archive_abandoned_carts(conn, cart_days)
+    compacted = compact(conn, vacuum_pages)
+    log_table_sizes(conn)
+    return {
+        'recently_viewed_trimmed': trimmed,
+        'carts_archived': archived['carts'],
+        'cart_lines_archived': archived['lines'],
+        **compacted,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trim, archive and compact the Guitar Store database.')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--once', action='store_true', help='run maintenance once and exit (default)')
+    mode.add_argument('--daemon', action='store_true', help='keep running, every --interval seconds')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--interval', type=int, default=86400, help='seconds between runs in daemon mode')
+    parser.add_argument('--keep-recent', type=int, default=RECENTLY_VIEWED_KEEP,
+                        help='recently viewed rows kept per user')
+    parser.add_argument('--cart-days', type=int, default=CART_RETENTION_DAYS,
+                        help='archive carts untouched for this many days')
+    parser.add_argument('--vacuum-pages', type=int, default=VACUUM_PAGES,
+                        help='free pages to release per run (0 = all)')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='convert the database to auto_vacuum=INCREMENTAL (runs a full VACUUM) first')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    conn = get_db_connection(args.db)
+    try:
+        if args.enable_incremental_vacuum:
+            enable_incremental_vacuum(conn)
+            logger.info("Enabled incremental auto_vacuum")
+        while True:
+            summary = run_maintenance(conn, args.keep_recent, args.cart_days, args.vacuum_pages)
+            logger.info(f"Maintenance finished: {summary}")
+            if not args.daemon:
+                break
+            time.sleep(args.interval)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+In-process metrics for Guitar Store
+
+A tiny thread-safe registry of counters, gauges and timings. Values are kept
+per worker process and exposed as JSON by the /api/metrics route.
+"""
+
+import threading
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def incr(name: str, value: int = 1) -> None:
+    """Increase a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set a gauge to its current value."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record the duration of one operation."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+
+
+def snapshot() -> Dict[str, dict]:
+    """Return a copy of all metrics, with average durations filled in."""
+    with _lock:
+        timings = {
+            name: {**timing, 'avg': timing['total'] / timing['count'] if timing['count'] else 0.0}
+            for name, timing in _timings.items()
+        }
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': timings,
+        }
@@ -0,0 +1,140 @@
+"""
+Database migration to move YouTube video data into a product_videos table.
+
+Videos used to be stored as a JSON blob in products.youtube_links, which was
+decoded on every product page view and carried along by every listing query.
+This migration creates the normalized product_videos table, converts the
+existing JSON data into rows and clears the blob column afterwards.
+"""
+import json
+import re
+import sqlite3
+import os
+from datetime import datetime
+
+# Matches youtu.be/<id>, youtube.com/watch?v=<id> and youtube.com/embed/<id>
+VIDEO_ID_PATTERN = re.compile(r'(?:youtu\.be/|[?&]v=|/embed/)([A-Za-z0-9_-]{11})')
+
+def get_db_connection():
+    """Create and return a database connection."""
+    db_path = os.path.join('instance', 'cart.db')
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def check_column_exists(conn, table, column):
+    """Check if a column exists in a table."""
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = [col[1] for col in cursor.fetchall()]
+    return column in columns
+
+def parse_video_id(url):
+    """Extract the YouTube video id from a video URL."""
+    match = VIDEO_ID_PATTERN.search(url or '')
+    return match.group(1) if match else None
+
+def parse_duration_seconds(duration):
+    """Convert a duration string like '8:51' or '1:02:03' to seconds."""
+    seconds = 0
+    try:
+        for part in (duration or '').split(':'):
+            seconds = seconds * 60 + int(part)
+    except ValueError:
+        return 0
+    return seconds
+
+def create_product_videos_table(conn):
+    """Create the product_videos table and its index if they don't exist."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_videos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            video_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            channel TEXT,
+            duration_seconds INTEGER DEFAULT 0,
+            views INTEGER DEFAULT 0,
+            published TEXT,
+            rank INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (product_id) REFERENCES products(id)
+        )
+    ''')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_product_videos_product_id ON product_videos (product_id, rank)'
+    )
+
+def convert_youtube_links():
+    """Copy JSON video data from products.youtube_links into product_videos."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        create_product_videos_table(conn)
+
+        if not check_column_exists(conn, 'products', 'youtube_links'):
+            print("Column 'youtube_links' not found in 'products' table, nothing to convert")
+            conn.commit()
+            return 0
+
+        products = conn.execute(
+            'SELECT id, name, youtube_links FROM products WHERE youtube_links IS NOT NULL'
+        ).fetchall()
+
+        converted = 0
+        for product in products:
+            try:
+                videos = json.loads(product['youtube_links'])
+            except (json.JSONDecodeError, TypeError):
+                print(f"Skipping {product['name']}: invalid JSON in youtube_links")
+                continue
+
+            rows = []
+            for rank, video in enumerate(videos):
+                video_id = parse_video_id(video.get('url'))
+                if not video_id:
+                    print(f"Skipping video without a YouTube id for {product['name']}: {video.get('url')}")
+                    continue
+                rows.append((
+                    product['id'],
+                    video_id,
+                    video.get('title', ''),
+                    video.get('channel'),
+                    parse_duration_seconds(video.get('duration')),
+                    int(video.get('views') or 0),
+                    video.get('published'),
+                    rank,
+                ))
+
+            # Re-running the migration replaces a product's videos instead of duplicating them
+            conn.execute('DELETE FROM product_videos WHERE product_id = ?', (product['id'],))
+            conn.executemany(
+                '''INSERT INTO product_videos
+                   (product_id, video_id, title, channel, duration_seconds, views, published, rank)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                rows
+            )
+            # Drop the blob so listing scans no longer carry it
+            conn.execute('UPDATE products SET youtube_links = NULL WHERE id = ?', (product['id'],))
+            converted += 1
+            print(f"Converted: {product['name']} ({len(rows)} videos)")
+
+        conn.commit()
+        return converted
+
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        if conn:
+            conn.rollback()
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    print(f"\nRunning migration: {os.path.basename(__file__)}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("-" * 50)
+
+    converted_count = convert_youtube_links()
+
+    print(f"\nMigration completed. Products converted: {converted_count}")
@@ -0,0 +1,121 @@
+"""
+Database migration to key cart_items by product_id.
+
+Cart lines used to store a free-text name and price copied from the
+product, and "in cart" checks matched on name. This migration rebuilds
+cart_items so every line references a product (unique per user) and keeps
+only a price snapshot taken when the item was added:
+
+- legacy rows without a product_id are matched to a product by name
+  (exact first, then case-insensitive)
+- duplicate lines for the same user and product are merged, summing
+  their quantities and keeping the newest price as the snapshot
+- rows that match no product, or belong to no user, are dropped and listed
+"""
+import sqlite3
+import os
+from datetime import datetime
+
+def get_db_connection():
+    """Create and return a database connection."""
+    db_path = os.path.join('instance', 'cart.db')
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def check_column_exists(conn, table, column):
+    """Check if a column exists in a table."""
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = [col[1] for col in cursor.fetchall()]
+    return column in columns
+
+def migrate_cart_items():
+    """Rebuild cart_items around product_id, backfilling legacy rows by name."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        if check_column_exists(conn, 'cart_items', 'price_snapshot'):
+            print("Table 'cart_items' already uses product_id and price_snapshot")
+            return
+
+        # Backfill product_id for legacy rows by exact name, then case-insensitively
+        cursor.execute('''
+            UPDATE cart_items
+            SET product_id = (SELECT p.id FROM products p WHERE p.name = cart_items.name ORDER BY p.id LIMIT 1)
+            WHERE product_id IS NULL
+        ''')
+        exact_matches = cursor.rowcount
+        cursor.execute('''
+            UPDATE cart_items
+            SET product_id = (SELECT p.id FROM products p WHERE LOWER(p.name) = LOWER(cart_items.name) ORDER BY p.id LIMIT 1)
+            WHERE product_id IS NULL
+        ''')
+        print(f"Backfilled product_id by name for {exact_matches + cursor.rowcount} rows")
+
+        orphans = cursor.execute('''
+            SELECT id, user_id, name FROM cart_items
+            WHERE user_id IS NULL OR product_id IS NULL
+               OR product_id NOT IN (SELECT id FROM products)
+        ''').fetchall()
+        for row in orphans:
+            print(f"Dropping cart row {row['id']} ({row['name']}, user {row['user_id']}): no matching user or product")
+
+        # Very old databases never had created_at on cart_items
+        created_at = 'MIN(ci.created_at)' if check_column_exists(conn, 'cart_items', 'created_at') else 'CURRENT_TIMESTAMP'
+
+        cursor.execute('ALTER TABLE cart_items RENAME TO cart_items_legacy')
+        cursor.execute('''
+            CREATE TABLE cart_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL DEFAULT 1,
+                price_snapshot REAL NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (product_id) REFERENCES products(id),
+                UNIQUE (user_id, product_id)
+            )
+        ''')
+
+        # Merge duplicate lines; the newest row's price becomes the snapshot
+        cursor.execute(f'''
+            INSERT INTO cart_items (id, user_id, product_id, quantity, price_snapshot, created_at)
+            SELECT merged.last_id, merged.user_id, merged.product_id, merged.quantity,
+                   newest.price, merged.created_at
+            FROM (
+                SELECT MAX(ci.id) AS last_id, ci.user_id, ci.product_id,
+                       SUM(COALESCE(ci.quantity, 1)) AS quantity,
+                       {created_at} AS created_at
+                FROM cart_items_legacy ci
+                WHERE ci.user_id IS NOT NULL
+                  AND ci.product_id IN (SELECT id FROM products)
+                GROUP BY ci.user_id, ci.product_id
+            ) merged
+            JOIN cart_items_legacy newest ON newest.id = merged.last_id
+        ''')
+        migrated = cursor.rowcount
+        cursor.execute('DROP TABLE cart_items_legacy')
+
+        conn.commit()
+        print(f"Successfully rebuilt 'cart_items' with {migrated} lines ({len(orphans)} rows dropped)")
+
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    print(f"\nRunning migration: {os.path.basename(__file__)}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("-" * 50)
+
+    migrate_cart_items()
+
+    print("\nMigration completed.")
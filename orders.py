@@ -0,0 +1,280 @@
+"""
+Orders and the queued checkout writer for Guitar Store
+
+Checkout requests don't write to the database themselves. They are queued
+to a single writer thread per worker, which takes up to BATCH_SIZE queued
+checkouts at a time and places them in one IMMEDIATE transaction: one lock
+acquisition and one fsync per batch instead of per order, and no request
+thread ever waits on SQLITE_BUSY. Stock is decremented with a conditional
+UPDATE, so an order either gets every line or is rejected, and never drives
+stock negative.
+
+Each order carries a client-chosen idempotency key, unique per user. A
+repeated checkout with the same key returns the order already recorded
+for it (placed or rejected) instead of placing another one.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import events
+import metrics
+from cache import bump_stock_version
+
+logger = logging.getLogger(__name__)
+
+# Queued checkouts placed per transaction
+BATCH_SIZE = 100
+
+# Checkouts waiting for the writer before new ones are turned away
+MAX_QUEUED = 5000
+
+STATUS_PLACED = 'placed'
+STATUS_REJECTED = 'rejected'
+
+Lines = List[Tuple[int, int]]
+
+
+class CheckoutBusyError(Exception):
+    """Raised when the checkout queue is full."""
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the orders and order_lines tables."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, idempotency_key)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_lines (
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_price REAL NOT NULL,
+            PRIMARY KEY (order_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+
+def get_order(conn: sqlite3.Connection, user_id: int, idempotency_key: str) -> Optional[Dict]:
+    """Return the user's order for an idempotency key with its lines, or None."""
+    row = conn.execute(
+        'SELECT id, status, total, error, created_at FROM orders WHERE user_id = ? AND idempotency_key = ?',
+        (user_id, idempotency_key)
+    ).fetchone()
+    if row is None:
+        return None
+    lines = conn.execute(
+        'SELECT product_id, quantity, unit_price FROM order_lines WHERE order_id = ? ORDER BY product_id',
+        (row[0],)
+    ).fetchall()
+    return {
+        'id': row[0],
+        'idempotency_key': idempotency_key,
+        'status': row[1],
+        'total': row[2],
+        'error': row[3],
+        'created_at': row[4],
+        'lines': [{'product_id': line[0], 'quantity': line[1], 'unit_price': line[2]} for line in lines],
+    }
+
+
+def place_order(conn: sqlite3.Connection, user_id: int, idempotency_key: str, lines: Lines) -> Dict:
+    """Record one order inside the caller's transaction and return it.
+
+    Stock for every line is decremented, and the lines removed from the
+    user's cart, or nothing changes and the order is recorded as rejected.
+    If an unexpected error is raised, the order's changes are rolled back
+    and the rest of the caller's transaction is kept.
+    """
+    existing = get_order(conn, user_id, idempotency_key)
+    if existing is not None:
+        metrics.incr('orders.duplicate')
+        return existing
+
+    conn.execute('SAVEPOINT place_order')
+    try:
+        return _place_order(conn, user_id, idempotency_key, lines)
+    except BaseException:
+        # Some errors (e.g. a full disk) roll back the whole transaction already
+        if conn.in_transaction:
+            conn.execute('ROLLBACK TO place_order')
+            conn.execute('RELEASE place_order')
+        raise
+
+
+def _place_order(conn: sqlite3.Connection, user_id: int, idempotency_key: str, lines: Lines) -> Dict:
+    total = 0.0
+    placed = []
+    error = None
+    for product_id, quantity in lines:
+        # fetchall() steps the statement to completion before the next one runs
+        rows = conn.execute(
+            'UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ? RETURNING price',
+            (quantity, product_id, quantity)
+        ).fetchall()
+        if not rows:
+            error = f'Insufficient stock for product {product_id}'
+            break
+        price = rows[0][0] or 0
+        total += price * quantity
+        placed.append((product_id, quantity, price))
+    if error is not None:
+        conn.execute('ROLLBACK TO place_order')
+        conn.execute('RELEASE place_order')
+        conn.execute(
+            'INSERT INTO orders (user_id, idempotency_key, status, error) VALUES (?, ?, ?, ?)',
+            (user_id, idempotency_key, STATUS_REJECTED, error)
+        )
+        metrics.incr('orders.rejected')
+        return get_order(conn, user_id, idempotency_key)
+
+    order_id = conn.execute(
+        'INSERT INTO orders (user_id, idempotency_key, status, total) VALUES (?, ?, ?, ?)',
+        (user_id, idempotency_key, STATUS_PLACED, round(total, 2))
+    ).lastrowid
+    conn.executemany('INSERT INTO order_lines (order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?)',
+                     [(order_id, product_id, quantity, price) for product_id, quantity, price in placed])
+    conn.executemany('DELETE FROM cart_items WHERE user_id = ? AND product_id = ?',
+                     [(user_id, product_id) for product_id, _ in lines])
+    conn.execute('RELEASE place_order')
+    metrics.incr('orders.placed')
+    return get_order(conn, user_id, idempotency_key)
+
+
+class OrderWriter:
+    """Places queued checkouts from one thread, in batched transactions.
+
+    The thread and its connection are started on first use, so pre-forked
+    servers get one writer per worker; writers in different workers still
+    serialize on the database lock, waiting up to busy_timeout for it.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = BATCH_SIZE, max_queued: int = MAX_QUEUED,
+                 busy_timeout: float = 10.0, event_broker: Optional[events.EventBroker] = None):
+        self.db_path = db_path
+        # Told about the stock and carts changed by each committed batch
+        self.event_broker = event_broker
+        self.batch_size = batch_size
+        self.busy_timeout = busy_timeout
+        self._queue: "queue.Queue[tuple]" = queue.Queue(max_queued)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        # Keys submitted to this worker and not yet committed, for status polling
+        self._pending: Dict[Tuple[int, str], Future] = {}
+
+    def _ensure_started(self) -> None:
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='order-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, user_id: int, idempotency_key: str, lines: Lines) -> Future:
+        """Queue a checkout; the future resolves to the order (see get_order)."""
+        self._ensure_started()
+        with self._lock:
+            future = self._pending.get((user_id, idempotency_key))
+            if future is not None:
+                # The same checkout is already queued here
+                return future
+            future = self._pending[(user_id, idempotency_key)] = Future()
+        try:
+            self._queue.put_nowait((user_id, idempotency_key, lines, future))
+        except queue.Full:
+            with self._lock:
+                del self._pending[(user_id, idempotency_key)]
+            metrics.incr('orders.queue_full')
+            raise CheckoutBusyError('Too many checkouts queued')
+        metrics.set_gauge('orders.queue_depth', self._queue.qsize())
+        return future
+
+    def is_pending(self, user_id: int, idempotency_key: str) -> bool:
+        return (user_id, idempotency_key) in self._pending
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        # Readers keep going while the writer commits
+        conn.execute('PRAGMA journal_mode = WAL')
+        ensure_schema(conn)
+        return conn
+
+    def _run(self) -> None:
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            metrics.set_gauge('orders.queue_depth', self._queue.qsize())
+            self._place_batch(conn, batch)
+
+    def _place_batch(self, conn: sqlite3.Connection, batch: list) -> None:
+        start = time.perf_counter()
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for user_id, idempotency_key, lines, _ in batch:
+                try:
+                    results.append(place_order(conn, user_id, idempotency_key, lines))
+                except Exception as e:
+                    if not conn.in_transaction:
+                        raise
+                    # Only this checkout fails; its key stays free for a retry
+                    logger.exception(f"Placing order {idempotency_key!r} of user {user_id} failed")
+                    metrics.incr('orders.failed')
+                    results.append(e)
+            conn.execute('COMMIT')
+        except Exception as e:  # Fail this batch's checkouts but keep the writer running
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.exception(f"Placing a batch of {len(batch)} orders failed")
+            metrics.incr('orders.batch_failed')
+            results = [e] * len(batch)
+        metrics.observe('orders.batch', time.perf_counter() - start)
+
+        placed = any(isinstance(order, dict) and order['status'] == STATUS_PLACED for order in results)
+        if placed:
+            bump_stock_version()
+        for (user_id, idempotency_key, _, future), result in zip(batch, results):
+            with self._lock:
+                self._pending.pop((user_id, idempotency_key), None)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        if placed and self.event_broker is not None:
+            self._publish(conn, batch, results)
+
+    def _publish(self, conn: sqlite3.Connection, batch: list, results: list) -> None:
+        product_ids = set()
+        user_ids = set()
+        for (user_id, _, _, _), order in zip(batch, results):
+            if isinstance(order, dict) and order['status'] == STATUS_PLACED:
+                product_ids.update(line['product_id'] for line in order['lines'])
+                user_ids.add(user_id)
+        try:
+            events.publish_stock(self.event_broker, conn, product_ids)
+            for user_id in user_ids:
+                events.publish_cart(self.event_broker, conn, user_id)
+        except sqlite3.Error:  # Streams catch up when they next re-read their state
+            logger.exception("Publishing stock and cart changes failed")
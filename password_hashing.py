@@ -0,0 +1,149 @@
+"""
+Password hashing off the request threads
+
+Password hashes are deliberately expensive. Computing them inline in a
+request holds the GIL for the whole hash and stalls every other request in
+the worker, so hashing and verification run in a small process pool
+instead. The number of pending hash jobs is bounded; when the pool is
+saturated new jobs are rejected immediately with HasherBusyError rather
+than queueing up behind a login burst. A job counts as pending until the
+pool has finished it, even if its request gave up waiting; timeouts and a
+crashed pool are reported as HasherBusyError too.
+
+Pool processes are started from a fork server rather than forked from the
+worker, which by then runs other threads whose locks a forked child would
+inherit in whatever state they were in.
+"""
+
+import atexit
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+import metrics
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+# Pool processes per server worker; every worker of a pre-forked server starts its own pool
+DEFAULT_WORKERS = 2
+
+
+class HasherBusyError(Exception):
+    """Raised when too many hash jobs are already pending."""
+
+
+def parse_method(method: str) -> tuple:
+    """Split a Werkzeug hash method into its name and parameters, filling in Werkzeug's defaults
+
+    e.g. 'pbkdf2:sha256' -> ('pbkdf2', 'sha256', 600000), 'scrypt' -> ('scrypt', 32768, 8, 1)
+    """
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return name, hash_name, iterations
+    if name == 'scrypt':
+        return (name, *map(int, args)) if args else (name, 2 ** 15, 8, 1)
+    return (name, *args)
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords in a bounded process pool.
+
+    With workers=0 hashing runs inline in the calling thread, which is
+    useful for tests and single-threaded development servers.
+    """
+
+    def __init__(self, method: str = DEFAULT_METHOD, salt_length: int = 16,
+                 workers: int = DEFAULT_WORKERS, max_pending: int = 64, timeout: float = 10.0):
+        self.method = method
+        self._parsed_method = parse_method(method)
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Created on first use so pre-forked servers start one pool per worker
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('forkserver'))
+                    atexit.register(self._pool.shutdown, wait=False)
+        return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        # A pool whose worker died rejects every job; the next job starts a new one
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _track_pending(self, change: int) -> None:
+        with self._pending_lock:
+            self._pending += change
+            metrics.set_gauge('password_hash.queue_depth', self._pending)
+
+    def _run(self, operation: str, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            metrics.incr('password_hash.rejected')
+            raise HasherBusyError('Too many password hash jobs pending')
+        self._track_pending(1)
+        start = time.perf_counter()
+
+        def finished(_future=None):
+            metrics.observe(f'password_hash.{operation}', time.perf_counter() - start)
+            self._track_pending(-1)
+            self._slots.release()
+
+        if self.workers == 0:
+            try:
+                return fn(*args)
+            finally:
+                finished()
+
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            finished()
+            self._discard_pool(pool)
+            metrics.incr('password_hash.broken_pool')
+            raise HasherBusyError('Password hashing is unavailable')
+        # The slot is held until the job is done, not just until this request stops waiting
+        future.add_done_callback(finished)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            metrics.incr('password_hash.timeout')
+            raise HasherBusyError('Password hashing timed out')
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            metrics.incr('password_hash.broken_pool')
+            raise HasherBusyError('Password hashing is unavailable')
+
+    def hash(self, password: str) -> str:
+        """Hash a password with the configured parameters."""
+        return self._run('hash', generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        """Check a password against a stored hash."""
+        return self._run('verify', check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """Return True if a stored hash was made with different parameters."""
+        try:
+            return parse_method(pwhash.split('$', 1)[0]) != self._parsed_method
+        except ValueError:
+            return True
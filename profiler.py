@@ -0,0 +1,131 @@
+"""
+Sampling profiler for production requests
+
+A background thread wakes every `interval` seconds while at least one
+request is being profiled, reads the current stack of each profiled
+request thread with sys._current_frames() and counts it. Samples are wall
+clock, so time spent waiting on the database shows up as well as CPU. Stacks are kept
+folded ("endpoint;flask.app:dispatch_request;app:search;search.html:root 42"),
+aggregated across requests, which is the input format of flamegraph.pl,
+speedscope and most other flame graph viewers.
+
+Requests that aren't profiled cost one dictionary lookup, and the sampler
+sleeps when nothing is being profiled, so sampling 1% of requests is cheap
+enough to leave on. Stack sampling runs on a thread rather than a SIGPROF
+handler, since signal handlers only ever run on the main thread and
+threaded servers handle requests on others.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+# Seconds between samples
+INTERVAL = 0.005
+
+# Deepest stack kept; deeper frames nearest the root are dropped
+MAX_DEPTH = 128
+
+# Distinct stacks kept; samples of new stacks beyond this are counted as dropped
+MAX_STACKS = 20000
+
+
+def frame_label(frame) -> str:
+    """module:function, or file:function for code without a module such as compiled templates."""
+    code = frame.f_code
+    module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads between start() and stop() into folded stack counts."""
+
+    def __init__(self, interval: float = INTERVAL, max_depth: int = MAX_DEPTH, max_stacks: int = MAX_STACKS):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.dropped = 0
+        self.requests = 0
+        self._stacks: Counter = Counter()
+        # Thread ident -> label of the request it is serving
+        self._active: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_started(self) -> None:
+        # Started on first use so pre-forked servers get one sampler per worker
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                    self._thread.start()
+
+    def start(self, label: str) -> None:
+        """Profile the calling thread until stop(); label becomes the root of its stacks."""
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = label
+            self.requests += 1
+        self._wake.set()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._wake.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            self._sample()
+            time.sleep(self.interval)
+
+    def _sample(self) -> None:
+        with self._lock:
+            active = dict(self._active)
+        if not active:
+            return
+        frames = sys._current_frames()
+        stacks = []
+        for ident, label in active.items():
+            frame = frames.get(ident)
+            labels = []
+            while frame is not None and len(labels) < self.max_depth:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(label)
+            stacks.append(';'.join(reversed(labels)))
+        with self._lock:
+            for stack in stacks:
+                if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[stack] += 1
+                else:
+                    self.dropped += 1
+                self.samples += 1
+
+    def folded(self) -> str:
+        """Aggregated stacks in folded format, one "stack count" line each, hottest first."""
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'samples': self.samples,
+                'stacks': len(self._stacks),
+                'dropped': self.dropped,
+                'interval': self.interval,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self.samples = self.dropped = self.requests = 0
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+"Customers also viewed" recommendations for Guitar Store
+
+Computes item-to-item co-view similarity from recently_viewed and
+cart_items and stores the top neighbors of each product in
+product_recommendations, which the product page reads with one indexed
+lookup.
+
+Counting is incremental. Each (user, product) interaction is counted once:
+coview_user_items remembers every interaction already seen, so a new one
+only adds 1 to its pair count with each product that user touched before.
+Watermarks on recently_viewed.viewed_at and cart_items.id limit each run to
+events since the last run, and only products whose counts changed have
+their neighbor lists rebuilt. Similarity is cosine over users:
+
+    score(a, b) = coviews(a, b) / sqrt(users(a) * users(b))
+
+Run once from cron:
+    python recommendations.py --once
+
+Or as a long-lived background job:
+    python recommendations.py --daemon --interval 900
+"""
+
+import argparse
+import logging
+import math
+import os
+import sqlite3
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join('instance', 'cart.db')
+
+# Neighbors stored per product
+TOP_N = 6
+
+# Pairs seen together fewer times than this are noise
+MIN_COVIEWS = 1
+
+
+def get_db_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Create and return a database connection."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.create_function('sqrt', 1, math.sqrt, deterministic=True)
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the recommendation table and the job's counting tables."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_recommendations (
+            product_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            recommended_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (product_id, rank)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coview_user_items (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS coview_counts (
+            product_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            coviews INTEGER NOT NULL,
+            PRIMARY KEY (product_id, other_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS recommendation_state (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    conn.commit()
+
+
+def get_state(conn: sqlite3.Connection, name: str, default: str) -> str:
+    row = conn.execute('SELECT value FROM recommendation_state WHERE name = ?', (name,)).fetchone()
+    return row['value'] if row else default
+
+
+def set_state(conn: sqlite3.Connection, name: str, value) -> None:
+    conn.execute(
+        'INSERT INTO recommendation_state (name, value) VALUES (?, ?) '
+        'ON CONFLICT(name) DO UPDATE SET value = excluded.value',
+        (name, str(value))
+    )
+
+
+def collect_new_interactions(conn: sqlite3.Connection) -> int:
+    """Load interactions since the watermarks into temp.new_items and advance them."""
+    last_viewed_at = get_state(conn, 'last_viewed_at', '')
+    last_cart_id = int(get_state(conn, 'last_cart_id', '0'))
+
+    # Read the new watermarks first and only collect rows up to them, so rows
+    # committed while this runs are left for the next run instead of skipped
+    watermarks = conn.execute('''
+        SELECT (SELECT MAX(viewed_at) FROM recently_viewed) AS viewed_at,
+               (SELECT MAX(id) FROM cart_items) AS cart_id
+    ''').fetchone()
+    viewed_at = watermarks['viewed_at'] or last_viewed_at
+    cart_id = watermarks['cart_id'] or last_cart_id
+
+    conn.execute('DROP TABLE IF EXISTS temp.new_items')
+    # viewed_at is compared with >= because views in the same second as the
+    # watermark may not have been committed yet; already-seen pairs are skipped
+    conn.execute('''
+        CREATE TEMP TABLE new_items AS
+        SELECT DISTINCT e.user_id, e.product_id
+        FROM (
+            SELECT user_id, product_id FROM recently_viewed WHERE viewed_at >= ? AND viewed_at <= ?
+            UNION
+            SELECT user_id, product_id FROM cart_items WHERE id > ? AND id <= ?
+        ) e
+        WHERE NOT EXISTS (
+            SELECT 1 FROM coview_user_items s
+            WHERE s.user_id = e.user_id AND s.product_id = e.product_id
+        )
+    ''', (last_viewed_at, viewed_at, last_cart_id, cart_id))
+
+    set_state(conn, 'last_viewed_at', viewed_at)
+    set_state(conn, 'last_cart_id', cart_id)
+    return conn.execute('SELECT COUNT(*) FROM temp.new_items').fetchone()[0]
+
+
+def count_coviews(conn: sqlite3.Connection) -> None:
+    """Add the pair counts contributed by temp.new_items.
+
+    New items pair with everything the user touched before and with each
+    other; new-new pairs appear in both directions from the first insert,
+    so the reverse direction is only added for previously seen items.
+    """
+    conn.execute('INSERT INTO coview_user_items (user_id, product_id) SELECT user_id, product_id FROM temp.new_items')
+    conn.execute('''
+        INSERT INTO coview_counts (product_id, other_id, coviews)
+        SELECT product_id, other_id, COUNT(*) FROM (
+            SELECT n.product_id, s.product_id AS other_id
+            FROM temp.new_items n
+            JOIN coview_user_items s ON s.user_id = n.user_id AND s.product_id != n.product_id
+            UNION ALL
+            SELECT s.product_id, n.product_id
+            FROM temp.new_items n
+            JOIN coview_user_items s ON s.user_id = n.user_id AND s.product_id != n.product_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM temp.new_items o WHERE o.user_id = s.user_id AND o.product_id = s.product_id
+            )
+        )
+        GROUP BY product_id, other_id
+        ON CONFLICT(product_id, other_id) DO UPDATE SET coviews = coviews + excluded.coviews
+    ''')
+
+
+def rebuild_neighbors(conn: sqlite3.Connection, top_n: int = TOP_N) -> int:
+    """Recompute top_n neighbors for products touched by the new interactions."""
+    conn.execute('DROP TABLE IF EXISTS temp.touched')
+    conn.execute('''
+        CREATE TEMP TABLE touched AS
+        SELECT product_id FROM temp.new_items
+        UNION
+        SELECT c.other_id FROM coview_counts c WHERE c.product_id IN (SELECT product_id FROM temp.new_items)
+    ''')
+    conn.execute('DELETE FROM product_recommendations WHERE product_id IN (SELECT product_id FROM temp.touched)')
+    conn.execute('''
+        WITH item_users AS (
+            SELECT product_id, COUNT(*) AS users FROM coview_user_items GROUP BY product_id
+        ),
+        scored AS (
+            SELECT c.product_id, c.other_id,
+                   c.coviews / sqrt(a.users * b.users) AS score
+            FROM coview_counts c
+            JOIN item_users a ON a.product_id = c.product_id
+            JOIN item_users b ON b.product_id = c.other_id
+            JOIN products p ON p.id = c.other_id
+            WHERE c.product_id IN (SELECT product_id FROM temp.touched)
+              AND c.coviews >= ?
+        ),
+        ranked AS (
+            SELECT product_id, other_id, score,
+                   ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY score DESC, other_id) AS rank
+            FROM scored
+        )
+        INSERT INTO product_recommendations (product_id, rank, recommended_id, score)
+        SELECT product_id, rank, other_id, score FROM ranked WHERE rank <= ?
+    ''', (MIN_COVIEWS, top_n))
+    return conn.execute('SELECT COUNT(*) FROM temp.touched').fetchone()[0]
+
+
+def run_update(conn: sqlite3.Connection, top_n: int = TOP_N) -> Dict[str, int]:
+    """Fold new interactions into the co-view counts and refresh affected neighbor lists.
+
+    Runs in one transaction, so a failed run leaves the watermarks unchanged.
+    """
+    ensure_schema(conn)
+    try:
+        new_items = collect_new_interactions(conn)
+        touched = 0
+        if new_items:
+            count_coviews(conn)
+            touched = rebuild_neighbors(conn, top_n)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return {'new_interactions': new_items, 'products_updated': touched}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update "customers also viewed" product recommendations.')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--once', action='store_true', help='run a single update and exit (default)')
+    mode.add_argument('--daemon', action='store_true', help='keep running, updating every --interval seconds')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--interval', type=int, default=900, help='seconds between updates in daemon mode')
+    parser.add_argument('--top-n', type=int, default=TOP_N, help='neighbors stored per product')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    conn = get_db_connection(args.db)
+    try:
+        while True:
+            summary = run_update(conn, args.top_n)
+            logger.info(f"Recommendation update finished: {summary}")
+            if not args.daemon:
+                break
+            time.sleep(args.interval)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
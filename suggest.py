@@ -0,0 +1,70 @@
+"""
+Type-ahead suggestions for the header search box
+
+An in-memory prefix index over product names and categories. Every word
+start of a product name is indexed, so "paul" finds "Gibson Les Paul".
+Lookups are a binary search over a sorted list and never touch SQLite; the
+index is rebuilt from the database when the catalog version changes.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (kind, label, product id or None)
+Entry = Tuple[str, str, Optional[int]]
+
+
+class PrefixIndex:
+    """Sorted array of lowercase keys answering prefix queries with bisect."""
+
+    def __init__(self):
+        self.version = None
+        self._data: Tuple[List[str], List[Entry]] = ([], [])
+        self._lock = threading.Lock()
+
+    def build(self, products: Iterable[Tuple[int, str]], categories: Iterable[str], version) -> None:
+        """Replace the index contents with the given products and categories."""
+        pairs = []
+        for category in categories:
+            pairs.append((category.lower(), ('category', category, None)))
+        for product_id, name in products:
+            words = name.lower().split()
+            for start in range(len(words)):
+                pairs.append((' '.join(words[start:]), ('product', name, product_id)))
+        pairs.sort(key=lambda pair: pair[0])
+        keys = [key for key, _ in pairs]
+        entries = [entry for _, entry in pairs]
+        # Swap both lists in one assignment so readers never see a half-built index
+        self._data = (keys, entries)
+        self.version = version
+
+    def ensure_current(self, version, loader) -> None:
+        """Rebuild from loader() -> (products, categories) if the catalog changed."""
+        if self.version == version:
+            return
+        with self._lock:
+            if self.version != version:
+                products, categories = loader()
+                self.build(products, categories, version)
+
+    def lookup(self, prefix: str, limit: int = 8) -> List[Dict]:
+        """Return up to limit suggestions whose indexed words start with prefix."""
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        keys, entries = self._data
+        categories, products, seen = [], [], set()
+        index = bisect_left(keys, prefix)
+        # Stop after limit distinct matches so short prefixes stay cheap on large catalogs
+        while index < len(keys) and keys[index].startswith(prefix) and len(seen) < limit:
+            kind, label, product_id = entries[index]
+            if (kind, label) not in seen:
+                seen.add((kind, label))
+                suggestion = {'type': kind, 'label': label}
+                if product_id is not None:
+                    suggestion['id'] = product_id
+                (categories if kind == 'category' else products).append(suggestion)
+            index += 1
+        # Categories first, then products in key order
+        return categories + products
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Local YouTube thumbnail cache for Guitar Store
+
+Fetches the thumbnail of every video in product_videos once, crops it to
+16:9 (YouTube's hqdefault images are letterboxed 4:3), resizes it and
+stores it as WebP in the thumbnail directory. Product pages then link
+/thumbnails/<file> on this site instead of hotlinking img.youtube.com, so
+rendering a page never waits on a third party.
+
+File names carry a digest of their contents, so a stored file never
+changes and is served with an immutable Cache-Control header; a changed
+thumbnail gets a new name. video_thumbnails maps each video id to its
+file, and the product page query joins it by the stored video id.
+
+Thumbnails are fetched through a ThumbnailClient: YouTubeThumbnailClient
+in production, or DirectoryThumbnailClient reading <video_id>.jpg files
+from a local directory (--source-dir) for testing without network access.
+Resizing and WebP encoding need Pillow (pip install -r
+requirements-thumbnails.txt); without it the fetched JPEG is stored as is.
+
+Run once from cron, after youtube_refresh.py:
+    python thumbnails.py --once
+
+Or as a long-lived background job:
+    python thumbnails.py --daemon --interval 3600
+"""
+
+import abc
+import argparse
+import hashlib
+import io
+import logging
+import os
+import re
+import sqlite3
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Optional; thumbnails are then stored as fetched
+    Image = None
+
+from cache import CATALOG_VERSION_FILENAME, bump_catalog_version, configure_catalog_version
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join('instance', 'cart.db')
+THUMBNAIL_DIR = os.path.join('instance', 'thumbnails')
+
+# Stored size; product pages show thumbnails at most 480 CSS pixels wide
+WIDTH = 480
+HEIGHT = 270
+WEBP_QUALITY = 80
+
+# Failed fetches are retried after this many hours
+RETRY_HOURS = 24
+
+STATUS_OK = 'ok'
+STATUS_MISSING = 'missing'
+STATUS_ERROR = 'error'
+
+# Names store_thumbnail gives files: <video_id>-<digest>.<ext>
+THUMBNAIL_FILENAME = re.compile(r'[A-Za-z0-9_-]+-[0-9a-f]{12}\.(?:webp|jpg)')
+
+
+class ThumbnailNotFound(Exception):
+    """Raised by a client when a video has no thumbnail (e.g. the video was removed)."""
+
+
+class ThumbnailClient(abc.ABC):
+    """Fetches the original thumbnail image of a video."""
+
+    @abc.abstractmethod
+    def fetch(self, video_id: str) -> bytes:
+        """Return the image bytes, or raise ThumbnailNotFound."""
+
+
+class YouTubeThumbnailClient(ThumbnailClient):
+    """Downloads hqdefault.jpg from YouTube's image host."""
+
+    URL = 'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg'
+
+    def __init__(self, timeout: float = 10.0):
+        self.timeout = timeout
+
+    def fetch(self, video_id: str) -> bytes:
+        try:
+            with urllib.request.urlopen(self.URL.format(video_id=video_id), timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise ThumbnailNotFound(video_id) from e
+            raise
+
+
+class DirectoryThumbnailClient(ThumbnailClient):
+    """Reads <video_id>.jpg from a local directory; a stand-in for YouTube in tests."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def fetch(self, video_id: str) -> bytes:
+        try:
+            with open(os.path.join(self.directory, f'{video_id}.jpg'), 'rb') as f:
+                return f.read()
+        except FileNotFoundError as e:
+            raise ThumbnailNotFound(video_id) from e
+
+
+def get_db_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Create and return a database connection."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the video_thumbnails table."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS video_thumbnails (
+            video_id TEXT PRIMARY KEY,
+            filename TEXT,
+            status TEXT NOT NULL,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+
+def encode_thumbnail(data: bytes) -> Tuple[bytes, str]:
+    """Crop and resize an image to WIDTH x HEIGHT WebP; returns the bytes and file extension.
+
+    Without Pillow the original JPEG is returned unchanged.
+    """
+    if Image is None:
+        return data, 'jpg'
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        # Crop the letterbox bars: keep the centered 16:9 band
+        width, height = image.size
+        band = min(height, width * HEIGHT // WIDTH)
+        top = (height - band) // 2
+        image = image.crop((0, top, width, top + band)).resize((WIDTH, HEIGHT), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, 'WEBP', quality=WEBP_QUALITY, method=6)
+        return out.getvalue(), 'webp'
+
+
+def store_thumbnail(directory: str, video_id: str, data: bytes, extension: str) -> str:
+    """Write a thumbnail under a name derived from its contents and return the name."""
+    filename = f"{video_id}-{hashlib.sha256(data).hexdigest()[:12]}.{extension}"
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        # Written under a temporary name so a request never sees a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return filename
+
+
+def videos_due(conn: sqlite3.Connection, retry_hours: int = RETRY_HOURS) -> list:
+    """Video ids listed on product pages with no thumbnail yet, or whose last fetch failed long enough ago."""
+    rows = conn.execute('''
+        SELECT DISTINCT v.video_id
+        FROM product_videos v
+        LEFT JOIN video_thumbnails t ON t.video_id = v.video_id
+        WHERE t.video_id IS NULL
+           OR (t.status != ? AND t.fetched_at < datetime('now', ?))
+        ORDER BY v.video_id
+    ''', (STATUS_OK, f'-{retry_hours} hours')).fetchall()
+    return [row['video_id'] for row in rows]
+
+
+def record(conn: sqlite3.Connection, video_id: str, status: str, filename: Optional[str] = None) -> None:
+    conn.execute(
+        '''INSERT INTO video_thumbnails (video_id, filename, status, fetched_at)
+           VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+           ON CONFLICT(video_id) DO UPDATE SET
+               filename = COALESCE(excluded.filename, filename),
+               status = excluded.status,
+               fetched_at = excluded.fetched_at''',
+        (video_id, filename, status)
+    )
+
+
+def prune_unused(conn: sqlite3.Connection, directory: str) -> int:
+    """Forget thumbnails of videos no longer listed and delete thumbnail files nothing refers to.
+
+    Only files named like store_thumbnail's output are deleted, so anything
+    else kept in the directory is left alone.
+    """
+    conn.execute('DELETE FROM video_thumbnails WHERE video_id NOT IN (SELECT video_id FROM product_videos)')
+    conn.commit()
+    in_use = {row['filename'] for row in conn.execute('SELECT filename FROM video_thumbnails WHERE filename IS NOT NULL')}
+    removed = 0
+    for filename in os.listdir(directory):
+        if filename not in in_use and THUMBNAIL_FILENAME.fullmatch(filename):
+            os.remove(os.path.join(directory, filename))
+            removed += 1
+    return removed
+
+
+def run_fetch(conn: sqlite3.Connection, client: ThumbnailClient, directory: str,
+              limit: Optional[int] = None) -> Dict[str, int]:
+    """Fetch and store thumbnails for due videos; returns counts per outcome."""
+    ensure_schema(conn)
+    os.makedirs(directory, exist_ok=True)
+    due = videos_due(conn)[:limit]
+    summary = {STATUS_OK: 0, STATUS_MISSING: 0, STATUS_ERROR: 0}
+    for video_id in due:
+        try:
+            data, extension = encode_thumbnail(client.fetch(video_id))
+            record(conn, video_id, STATUS_OK, store_thumbnail(directory, video_id, data, extension))
+            summary[STATUS_OK] += 1
+        except ThumbnailNotFound:
+            record(conn, video_id, STATUS_MISSING)
+            summary[STATUS_MISSING] += 1
+        except Exception:  # Keep going; the video is retried after RETRY_HOURS
+            logger.exception(f"Fetching the thumbnail of {video_id} failed")
+            record(conn, video_id, STATUS_ERROR)
+            summary[STATUS_ERROR] += 1
+        conn.commit()
+    summary['pruned'] = prune_unused(conn, directory)
+    if summary[STATUS_OK]:
+        # Cached product pages are rendered with the thumbnail links
+        bump_catalog_version()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch product video thumbnails into the local thumbnail cache.')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--once', action='store_true', help='run a single pass and exit (default)')
+    mode.add_argument('--daemon', action='store_true', help='keep running, fetching every --interval seconds')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--dir', default=THUMBNAIL_DIR, help='directory thumbnails are stored and served from')
+    parser.add_argument('--source-dir', help='read <video_id>.jpg files from this directory instead of YouTube')
+    parser.add_argument('--limit', type=int, help='most thumbnails fetched per pass')
+    parser.add_argument('--interval', type=int, default=3600, help='seconds between passes in daemon mode')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if Image is None:
+        logger.warning("Pillow is not installed; thumbnails are stored as fetched, without resizing to WebP")
+    client = DirectoryThumbnailClient(args.source_dir) if args.source_dir else YouTubeThumbnailClient()
+    configure_catalog_version(os.path.join(os.path.dirname(os.path.abspath(args.db)), CATALOG_VERSION_FILENAME))
+    conn = get_db_connection(args.db)
+    try:
+        while True:
+            summary = run_fetch(conn, client, args.dir, args.limit)
+            logger.info(f"Thumbnail pass finished: {summary}")
+            if not args.daemon:
+                break
+            time.sleep(args.interval)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
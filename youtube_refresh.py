@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Incremental, quota-aware YouTube video refresh for Guitar Store
+
+Refreshes the product_videos table a few products at a time, most valuable
+products first, without exceeding the daily YouTube Data API quota.
+Products are prioritized by how stale their videos are and how popular
+they are (recent views and cart adds). Quota spent and per-product refresh
+times are checkpointed in the database after every product, so a run that
+stops on quota exhaustion resumes where it left off once the quota resets.
+
+Run once from cron:
+    python youtube_refresh.py --once
+
+Or as a long-lived background job:
+    python youtube_refresh.py --daemon
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from youtube_search import (
+    DEFAULT_DAILY_QUOTA,
+    QUOTA_COSTS,
+    QuotaExceededError,
+    VideoResult,
+    YouTubeSearcher,
+    configure_logging,
+    get_api_key,
+)
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join('instance', 'cart.db')
+
+# Quota resets at midnight Pacific time; expressed in UTC to avoid tz data
+QUOTA_RESET_HOUR_UTC = 8
+
+# Products refreshed more recently than this are never re-searched
+MIN_REFRESH_AGE_DAYS = 7
+
+# An empty search usually means the API call failed, so it is retried sooner
+EMPTY_RETRY_HOURS = 6
+
+# Staleness assigned to products that have never been refreshed
+NEVER_REFRESHED_AGE_DAYS = 365
+
+# A cart add signals more intent than a page view
+CART_WEIGHT = 3
+
+
+def get_db_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Create and return a database connection."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the checkpoint tables used by the scheduler."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS youtube_refresh_state (
+            product_id INTEGER PRIMARY KEY,
+            last_refreshed_at TIMESTAMP,
+            last_status TEXT,
+            FOREIGN KEY (product_id) REFERENCES products(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS youtube_quota_usage (
+            quota_day TEXT NOT NULL,
+            call_type TEXT NOT NULL,
+            units INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (quota_day, call_type)
+        )
+    ''')
+    conn.commit()
+
+
+def current_quota_day(now: Optional[datetime] = None) -> str:
+    """Return the quota period the given UTC time falls into."""
+    now = now or datetime.utcnow()
+    return (now - timedelta(hours=QUOTA_RESET_HOUR_UTC)).date().isoformat()
+
+
+def seconds_until_quota_reset(now: Optional[datetime] = None) -> float:
+    """Return the number of seconds until the next quota period starts."""
+    now = now or datetime.utcnow()
+    shifted = now - timedelta(hours=QUOTA_RESET_HOUR_UTC)
+    next_reset = datetime.combine(shifted.date() + timedelta(days=1), datetime.min.time())
+    return (next_reset - shifted).total_seconds()
+
+
+def quota_spent_today(conn: sqlite3.Connection, quota_day: str) -> Dict[str, int]:
+    """Return quota units spent per call type in the given quota period."""
+    rows = conn.execute(
+        'SELECT call_type, units FROM youtube_quota_usage WHERE quota_day = ?', (quota_day,)
+    ).fetchall()
+    return {row['call_type']: row['units'] for row in rows}
+
+
+def record_quota_usage(conn: sqlite3.Connection, quota_day: str, usage: Dict[str, int]) -> None:
+    """Add quota units spent to the running total for the period."""
+    conn.executemany(
+        '''INSERT INTO youtube_quota_usage (quota_day, call_type, units) VALUES (?, ?, ?)
+           ON CONFLICT(quota_day, call_type) DO UPDATE SET units = units + excluded.units''',
+        [(quota_day, call_type, units) for call_type, units in usage.items() if units]
+    )
+
+
+def prioritized_products(conn: sqlite3.Connection, now: Optional[datetime] = None) -> List[sqlite3.Row]:
+    """Return products due for a refresh, highest priority first.
+
+    Priority is staleness (days since the last refresh) weighted by
+    popularity, so a popular product goes stale first while rarely viewed
+    products are still refreshed eventually.
+    """
+    now = now or datetime.utcnow()
+    rows = conn.execute('''
+        SELECT p.id, p.name, p.category, rs.last_refreshed_at,
+               COALESCE(views.count, 0) AS view_count,
+               COALESCE(carts.count, 0) AS cart_count
+        FROM products p
+        LEFT JOIN youtube_refresh_state rs ON rs.product_id = p.id
+        LEFT JOIN (
+            SELECT product_id, COUNT(*) AS count FROM recently_viewed GROUP BY product_id
+        ) views ON views.product_id = p.id
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS count FROM cart_items
+            WHERE product_id IS NOT NULL GROUP BY product_id
+        ) carts ON carts.product_id = p.id
+        WHERE rs.last_refreshed_at IS NULL OR rs.last_refreshed_at < ?
+           OR (rs.last_status = 'empty' AND rs.last_refreshed_at < ?)
+    ''', (
+        (now - timedelta(days=MIN_REFRESH_AGE_DAYS)).strftime('%Y-%m-%d %H:%M:%S'),
+        (now - timedelta(hours=EMPTY_RETRY_HOURS)).strftime('%Y-%m-%d %H:%M:%S'),
+    )).fetchall()
+
+    def priority(row: sqlite3.Row) -> float:
+        if row['last_refreshed_at']:
+            last = datetime.strptime(row['last_refreshed_at'], '%Y-%m-%d %H:%M:%S')
+            age_days = (now - last).total_seconds() / 86400
+        else:
+            age_days = NEVER_REFRESHED_AGE_DAYS
+        popularity = row['view_count'] + CART_WEIGHT * row['cart_count']
+        return age_days * (1 + popularity)
+
+    return sorted(rows, key=priority, reverse=True)
+
+
+def save_product_videos(conn: sqlite3.Connection, product_id: int, videos: List[VideoResult]) -> None:
+    """Replace a product's videos with fresh search results."""
+    conn.execute('DELETE FROM product_videos WHERE product_id = ?', (product_id,))
+    conn.executemany(
+        '''INSERT INTO product_videos
+           (product_id, video_id, title, channel, duration_seconds, views, published, rank)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+        [
+            (product_id, video.video_id, video.title, video.channel,
+             video.duration_seconds, video.view_count, video.published_at, rank)
+            for rank, video in enumerate(videos)
+        ]
+    )
+
+
+def checkpoint(conn: sqlite3.Connection, product_id: int, status: str) -> None:
+    """Record that a product was processed so later runs skip it.
+
+    A product checkpointed as 'empty' is only skipped for EMPTY_RETRY_HOURS.
+    """
+    conn.execute(
+        '''INSERT INTO youtube_refresh_state (product_id, last_refreshed_at, last_status)
+           VALUES (?, CURRENT_TIMESTAMP, ?)
+           ON CONFLICT(product_id) DO UPDATE SET
+               last_refreshed_at = excluded.last_refreshed_at,
+               last_status = excluded.last_status''',
+        (product_id, status)
+    )
+
+
+def run_refresh(conn: sqlite3.Connection, searcher: YouTubeSearcher,
+                daily_budget: int = DEFAULT_DAILY_QUOTA) -> Dict[str, int]:
+    """Refresh as many due products as today's remaining budget allows.
+
+    Returns a summary with the number of products refreshed, products still
+    due, and quota units spent per call type during this run.
+    """
+    ensure_schema(conn)
+    quota_day = current_quota_day()
+    spent = sum(quota_spent_today(conn, quota_day).values())
+    searcher.quota_remaining = max(daily_budget - spent, 0)
+    searcher.quota_used = {call_type: 0 for call_type in QUOTA_COSTS}
+
+    products = prioritized_products(conn)
+    logger.info(f"{len(products)} products due, {searcher.quota_remaining} quota units left for {quota_day}")
+
+    refreshed = 0
+    for product in products:
+        used_before = dict(searcher.quota_used)
+        try:
+            videos = searcher.search_videos(product['name'])
+            status = 'ok' if videos else 'empty'
+        except QuotaExceededError as e:
+            logger.info(f"Quota exhausted, stopping until the next reset: {e}")
+            break
+        finally:
+            # Checkpoint spent quota even when the second API call failed
+            delta = {k: searcher.quota_used[k] - used_before.get(k, 0) for k in searcher.quota_used}
+            record_quota_usage(conn, quota_day, delta)
+            conn.commit()
+
+        # An empty result usually means an API error; keep the videos we had
+        # and retry after EMPTY_RETRY_HOURS rather than MIN_REFRESH_AGE_DAYS
+        if videos:
+            save_product_videos(conn, product['id'], videos)
+        checkpoint(conn, product['id'], status)
+        conn.commit()
+        refreshed += 1
+        logger.info(f"Refreshed {product['name']}: {len(videos)} videos")
+
+    return {
+        'refreshed': refreshed,
+        'remaining': len(products) - refreshed,
+        **{f'quota_{call_type}': units for call_type, units in searcher.quota_used.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh YouTube sound demo videos within the daily API quota.')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--once', action='store_true', help='run a single refresh pass and exit (default)')
+    mode.add_argument('--daemon', action='store_true', help='keep running, resuming after each quota reset')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--budget', type=int, default=DEFAULT_DAILY_QUOTA,
+                        help='quota units this job may spend per day')
+    parser.add_argument('--idle-interval', type=int, default=3600,
+                        help='seconds to wait in daemon mode when no product is due')
+    args = parser.parse_args()
+
+    configure_logging()
+    api_key = get_api_key()
+    if not api_key:
+        sys.exit(1)
+
+    searcher = YouTubeSearcher(api_key)
+    conn = get_db_connection(args.db)
+    try:
+        while True:
+            summary = run_refresh(conn, searcher, args.budget)
+            logger.info(f"Refresh pass finished: {summary}")
+            if not args.daemon:
+                break
+            if summary['remaining']:
+                # Out of quota with work left; resume from the checkpoint after reset
+                time.sleep(seconds_until_quota_reset())
+            else:
+                time.sleep(args.idle_interval)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
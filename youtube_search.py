@@ -7,36 +7,53 @@ generates a markdown file with links to the top 3 videos for each product.
 """
 
 import os
+import re
 import sqlite3
+import sys
 import logging
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from dotenv import load_dotenv
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('youtube_search.log'),
-        logging.StreamHandler()
-    ]
-)
+
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
 
-if not YOUTUBE_API_KEY or YOUTUBE_API_KEY == 'your_api_key_here':
-    logger.error("Please set up your YouTube API key in the .env file")
-    logger.info("1. Create a .env file based on .env.example")
-    logger.info("2. Get an API key from Google Cloud Console")
-    logger.info("3. Enable YouTube Data API v3 for your project")
-    exit(1)
+def configure_logging() -> None:
+    """Log to youtube_search.log and the console; called by the command line entry points."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('youtube_search.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+
+def get_api_key() -> Optional[str]:
+    """Return the YouTube API key from the environment or .env, or None with setup help logged."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv('YOUTUBE_API_KEY')
+    if not api_key or api_key == 'your_api_key_here':
+        logger.error("Please set up your YouTube API key in the .env file")
+        logger.info("1. Create a .env file based on .env.example")
+        logger.info("2. Get an API key from Google Cloud Console")
+        logger.info("3. Enable YouTube Data API v3 for your project")
+        return None
+    return api_key
+
+# Quota units charged by the YouTube Data API per call type
+QUOTA_COSTS = {
+    'search': 100,
+    'videos': 1,
+}
+DEFAULT_DAILY_QUOTA = 10000
+
+
+class QuotaExceededError(Exception):
+    """Raised when a call would exceed the remaining YouTube API quota."""
+
 
 @dataclass
 class VideoResult:
@@ -47,18 +64,41 @@ class VideoResult:
     published_at: str
     duration: str = ""
     view_count: int = 0
+    duration_seconds: int = 0
 
 class YouTubeSearcher:
     """Handles YouTube searches and result processing."""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, quota_remaining: int = DEFAULT_DAILY_QUOTA):
+        # googleapiclient is slow to import, so only searchers pay for it
+        from googleapiclient.discovery import build
         self.youtube = build('youtube', 'v3', developerKey=api_key)
-        self.quota_remaining = 10000  # Default quota, will be updated
+        self.quota_remaining = quota_remaining
+        self.quota_used: Dict[str, int] = {call_type: 0 for call_type in QUOTA_COSTS}
+    
+    def _spend_quota(self, call_type: str) -> None:
+        """Charge the quota cost of an API call, refusing calls we can't afford."""
+        cost = QUOTA_COSTS[call_type]
+        if cost > self.quota_remaining:
+            raise QuotaExceededError(
+                f"{call_type} costs {cost} units but only {self.quota_remaining} remain"
+            )
+        self.quota_remaining -= cost
+        self.quota_used[call_type] += cost
     
     def search_videos(self, query: str, max_results: int = 3) -> List[VideoResult]:
-        """Search YouTube for videos matching the query."""
+        """Search YouTube for videos matching the query.
+        
+        Raises QuotaExceededError when the remaining quota can't cover the
+        search, or when the API reports the daily quota as exhausted.
+        """
+        # Both calls are needed for a usable result, so check up front
+        if QUOTA_COSTS['search'] + QUOTA_COSTS['videos'] > self.quota_remaining:
+            raise QuotaExceededError(f"Only {self.quota_remaining} quota units remain")
+        from googleapiclient.errors import HttpError
         try:
             # First search for videos
+            self._spend_quota('search')
             search_response = self.youtube.search().list(
                 q=f"{query} sound demo",
                 part='id,snippet',
@@ -75,6 +115,7 @@ class YouTubeSearcher:
                 return []
                 
             # Get video details including duration and view count
+            self._spend_quota('videos')
             video_response = self.youtube.videos().list(
                 part='contentDetails,statistics',
                 id=','.join(video_ids)
@@ -94,6 +135,7 @@ class YouTubeSearcher:
                     
                 # Parse duration (ISO 8601 format to MM:SS)
                 duration = self._parse_duration(video_info['contentDetails']['duration'])
+                duration_seconds = self._parse_duration_seconds(video_info['contentDetails']['duration'])
                 
                 videos.append(VideoResult(
                     title=item['snippet']['title'],
@@ -101,7 +143,8 @@ class YouTubeSearcher:
                     channel=item['snippet']['channelTitle'],
                     published_at=item['snippet']['publishedAt'].split('T')[0],
                     duration=duration,
-                    view_count=int(video_info['statistics'].get('viewCount', 0))
+                    view_count=int(video_info['statistics'].get('viewCount', 0)),
+                    duration_seconds=duration_seconds
                 ))
                 
             return videos
@@ -110,6 +153,8 @@ class YouTubeSearcher:
             logger.error(f"YouTube API error: {e}")
             if e.resp.status == 403 and 'quota' in str(e).lower():
                 logger.error("YouTube API quota exceeded")
+                self.quota_remaining = 0
+                raise QuotaExceededError("YouTube API reported the daily quota as exceeded") from e
             return []
         except Exception as e:
             logger.error(f"Error searching YouTube: {e}")
@@ -129,6 +174,15 @@ class YouTubeSearcher:
             seconds = duration.split('S')[0].zfill(2)
             
         return f"{minutes}:{seconds}"
+    
+    @staticmethod
+    def _parse_duration_seconds(duration: str) -> int:
+        """Convert ISO 8601 duration (e.g. PT1H2M3S) to a number of seconds."""
+        match = re.match(r'P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$', duration or '')
+        if not match:
+            return 0
+        days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+        return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
 
 
 def get_products(db_path: str) -> List[Tuple[str, str]]:
@@ -177,8 +231,13 @@ def generate_markdown(products: Dict[str, Dict[str, List[VideoResult]]]) -> str:
 
 def main():
     """Main function to execute the script."""
+    configure_logging()
+    api_key = get_api_key()
+    if not api_key:
+        sys.exit(1)
+
     # Initialize YouTube searcher
-    searcher = YouTubeSearcher(YOUTUBE_API_KEY)
+    searcher = YouTubeSearcher(api_key)
     
     # Get products from database
     db_path = os.path.join('instance', 'cart.db')
@@ -199,12 +258,20 @@ def main():
     
     # Search for videos
     results = {}
+    quota_exhausted = False
     for category, product_names in categories.items():
         results[category] = {}
         for product in product_names:
             logger.info(f"Searching for: {product}")
-            videos = searcher.search_videos(product)
+            try:
+                videos = searcher.search_videos(product)
+            except QuotaExceededError as e:
+                logger.error(f"Stopping search early: {e}")
+                quota_exhausted = True
+                break
             results[category][product] = videos
+        if quota_exhausted:
+            break
     
     # Generate markdown
     markdown_content = generate_markdown(results)